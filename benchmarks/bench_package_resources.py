@@ -0,0 +1,326 @@
+"""
+Headless benchmarks for the package_resources hot paths.
+
+A stub "sublime" module is installed so package_resources can be imported
+outside of Sublime Text. Each run generates a synthetic install, times the
+public functions against it and records wall time and peak memory (from
+tracemalloc) per operation as JSON.
+
+Usage:
+    git worktree add ../baseline <revision>
+    python benchmarks/bench_package_resources.py --source ../baseline --output before.json
+    python benchmarks/bench_package_resources.py --output after.json
+    python benchmarks/bench_package_resources.py --compare before.json after.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import zipfile
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Settings(object):
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+def install_sublime_stub(root, version):
+    """
+    Install a minimal "sublime" module whose package roots point at the
+    synthetic install.
+    """
+    settings = _Settings({"ignored_packages": [], "ignore_patterns": ["\\.(git|hg|svn|DS_Store)"]})
+    sublime = types.ModuleType("sublime")
+    sublime.version = lambda: str(version)
+    sublime.packages_path = lambda: os.path.join(root, "Packages")
+    sublime.installed_packages_path = lambda: os.path.join(root, "Installed Packages")
+    sublime.executable_path = lambda: os.path.join(root, "exe", "sublime_text")
+    sublime.cache_path = lambda: os.path.join(root, "Cache")
+    sublime.load_settings = lambda name: settings
+    sublime.set_timeout = lambda callback, delay=0: callback()
+    sublime.set_timeout_async = lambda callback, delay=0: callback()
+    sublime.status_message = lambda message: None
+    sublime.message_dialog = lambda message: None
+
+    def load_binary_resource(name):
+        package, resource = name.split("/", 2)[1:]
+        path = os.path.join(sublime.packages_path(), package, *resource.split("/"))
+        if os.path.isfile(path):
+            with open(path, "rb") as file_obj:
+                return file_obj.read()
+        for directory in [sublime.installed_packages_path(), os.path.join(root, "exe", "Packages")]:
+            path = os.path.join(directory, package + ".sublime-package")
+            if os.path.isfile(path):
+                with zipfile.ZipFile(path) as zip_file:
+                    if resource in zip_file.namelist():
+                        return zip_file.read(resource)
+        raise IOError("resource not found")
+
+    sublime.load_binary_resource = load_binary_resource
+    sublime.load_resource = lambda name: load_binary_resource(name).decode("utf-8").replace("\r", "")
+    sys.modules["sublime"] = sublime
+    return sublime
+
+
+def generate_install(root, args):
+    """
+    Create N loose packages and M zipped packages, split between the
+    Installed Packages and executable Packages directories. Every package
+    has a tree of the requested depth, a .git directory and one large member.
+    """
+    rng = random.Random(args.seed)
+    for directory in ["Packages", "Installed Packages", os.path.join("exe", "Packages"), "Cache"]:
+        os.makedirs(os.path.join(root, directory))
+    open(os.path.join(root, "exe", "sublime_text"), "w").close()
+
+    large_member = bytes(bytearray(rng.getrandbits(8) for _ in range(1024))) * (args.large_size // 1024)
+
+    def package_files(package):
+        files = {}
+        for index in range(args.files):
+            depth = index % (args.depth + 1)
+            directories = ["dir%d" % level for level in range(depth)]
+            name = "/".join(directories + ["file%d.sublime-syntax" % index])
+            files[name] = ("%s line %d\r\n" % (package, index)) * args.lines
+        for index in range(args.git_objects):
+            files[".git/objects/%02x/%038x" % (index % 256, index)] = "object"
+        files["assets/large.bin"] = large_member
+        return files
+
+    packages = {"loose": [], "zipped": []}
+    for index in range(args.loose):
+        package = "Loose%04d" % index
+        for name, content in package_files(package).items():
+            path = os.path.join(root, "Packages", package, *name.split("/"))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as file_obj:
+                file_obj.write(content if isinstance(content, bytes) else content.encode("utf-8"))
+        packages["loose"].append(package)
+
+    for index in range(args.zipped):
+        package = "Zipped%04d" % index
+        directory = "Installed Packages" if index % 2 == 0 else os.path.join("exe", "Packages")
+        path = os.path.join(root, directory, package + ".sublime-package")
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for name, content in sorted(package_files(package).items()):
+                compress_type = zipfile.ZIP_STORED if name.endswith(".bin") else zipfile.ZIP_DEFLATED
+                zip_file.writestr(name, content, compress_type)
+        packages["zipped"].append(package)
+
+    return packages
+
+
+def reset_caches(package_resources, root):
+    """
+    Drop every in-memory and on-disk cache so the next call runs cold.
+    Caches are looked up by name and skipped when missing, so the harness
+    also runs against revisions that predate them.
+    """
+    zip_pool = getattr(package_resources, "_zip_pool", None)
+    if zip_pool is not None:
+        zip_pool.close()
+    for name in ["_content_cache", "_ignore_matchers", "_path_tables", "_resolution_map"]:
+        cache = getattr(package_resources, name, None)
+        if cache is not None:
+            cache.clear()
+    if hasattr(package_resources, "_package_roots"):
+        package_resources._package_roots = None
+    index = getattr(package_resources, "_resource_index", None)
+    if index is not None:
+        if index.save_timer is not None:
+            index.save_timer.cancel()
+        package_resources._resource_index = None
+    shutil.rmtree(os.path.join(root, "Cache"), ignore_errors=True)
+    os.makedirs(os.path.join(root, "Cache"))
+
+
+def measure(results, name, function, repeat, setup=None):
+    """
+    Time the function without tracing, then run it once more under
+    tracemalloc to record its peak memory. setup runs before every call.
+    An operation that raises is recorded with its error, so revisions with
+    bugs in one function can still be compared on the others.
+    """
+    times = []
+    calls = 0
+    try:
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            calls = function()
+            times.append(time.perf_counter() - start)
+
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    except Exception as e:
+        results[name] = {"error": "%s: %s" % (type(e).__name__, e)}
+        print("%-36s failed: %s" % (name, results[name]["error"]))
+        return
+    finally:
+        tracemalloc.stop()
+
+    results[name] = {
+        "time": min(times),
+        "mean_time": sum(times) / len(times),
+        "peak_bytes": peak,
+        "calls": calls
+    }
+    print("%-36s %9.4fs %12d bytes" % (name, results[name]["time"], peak))
+
+
+def run_benchmarks(args):
+    root = tempfile.mkdtemp(prefix="prv-bench-")
+    try:
+        install_sublime_stub(root, args.sublime_version)
+        sys.path.insert(0, os.path.abspath(args.source))
+        import package_resources
+
+        packages = generate_install(root, args)
+        all_packages = packages["loose"] + packages["zipped"]
+        ignore_patterns = ["\\.(git|hg|svn|DS_Store)"]
+        results = {}
+
+        def get_packages_list():
+            package_resources.get_packages_list(True, ignore_patterns)
+            return 1
+
+        def list_package_files():
+            for package in all_packages:
+                package_resources.list_package_files(package, ignore_patterns)
+            return len(all_packages)
+
+        def find_resource():
+            package_resources.find_resource(r"file1\d*\.sublime-syntax$")
+            return 1
+
+        def get_resource():
+            count = 0
+            for package in all_packages:
+                for index in range(0, args.files, max(1, args.files // 10)):
+                    depth = index % (args.depth + 1)
+                    name = "/".join(["dir%d" % level for level in range(depth)] + ["file%d.sublime-syntax" % index])
+                    package_resources.get_resource(package, name)
+                    count += 1
+            return count
+
+        def get_binary_resource():
+            for package in all_packages:
+                package_resources.get_binary_resource(package, "assets/large.bin")
+            return len(all_packages)
+
+        def extract_package():
+            for package in packages["zipped"]:
+                package_resources.extract_package(package)
+            return len(packages["zipped"])
+
+        operations = [
+            ("get_packages_list", get_packages_list),
+            ("list_package_files", list_package_files),
+            ("find_resource", find_resource),
+            ("get_resource", get_resource),
+            ("get_binary_resource", get_binary_resource)
+        ]
+
+        def reset():
+            reset_caches(package_resources, root)
+
+        def remove_extracted():
+            reset()
+            for package in packages["zipped"]:
+                shutil.rmtree(os.path.join(root, "Packages", package), ignore_errors=True)
+
+        for name, function in operations:
+            measure(results, name + ".cold", function, 1, reset)
+            measure(results, name + ".warm", function, args.repeat)
+
+        measure(results, "extract_package", extract_package, 1, remove_extracted)
+
+        return {
+            "config": vars(args),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results
+        }
+    finally:
+        if "package_resources" in sys.modules:
+            reset_caches(sys.modules["package_resources"], root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(base_path, new_path):
+    with open(base_path) as file_obj:
+        base = json.load(file_obj)["results"]
+    with open(new_path) as file_obj:
+        new = json.load(file_obj)["results"]
+
+    print("%-36s %10s %10s %8s %12s %12s" % ("operation", "base", "new", "speedup", "base peak", "new peak"))
+    for name in sorted(set(base) | set(new)):
+        if name not in base or name not in new:
+            print("%-36s %s" % (name, "only in " + (base_path if name in base else new_path)))
+            continue
+        if "error" in base[name] or "error" in new[name]:
+            print("%-36s %s" % (name, "failed in " + (base_path if "error" in base[name] else new_path)))
+            continue
+        speedup = base[name]["time"] / new[name]["time"] if new[name]["time"] > 0 else float("inf")
+        print("%-36s %9.4fs %9.4fs %7.2fx %12d %12d" % (
+            name, base[name]["time"], new[name]["time"], speedup,
+            base[name]["peak_bytes"], new[name]["peak_bytes"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loose", type=int, default=20, help="number of loose packages")
+    parser.add_argument("--zipped", type=int, default=100, help="number of zipped packages")
+    parser.add_argument("--files", type=int, default=200, help="files per package")
+    parser.add_argument("--depth", type=int, default=4, help="maximum directory depth")
+    parser.add_argument("--lines", type=int, default=20, help="lines per text file")
+    parser.add_argument("--git-objects", type=int, default=200, help="files in each package's ignored .git directory")
+    parser.add_argument("--large-size", type=int, default=1024 * 1024, help="size of the large member in bytes")
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs per operation, the best is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sublime-version", type=int, default=3013,
+        help="version reported by the stub; builds after 3013 use sublime.load_resource")
+    parser.add_argument("--source", default=REPOSITORY_PATH,
+        help="directory containing the package_resources.py to benchmark, such as a checkout of another revision")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as file_obj:
+            json.dump(report, file_obj, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
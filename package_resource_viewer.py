@@ -3,6 +3,14 @@ import sublime_plugin
 import os
 import threading
 import errno
+import json
+import re
+import time
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
 
 VERSION = int(sublime.version())
 IS_ST3 = VERSION >= 3006
@@ -11,6 +19,21 @@ if IS_ST3:
 else:
     from package_resources import *
 
+LISTING_WORKERS = 2
+MAX_PENDING_PREFETCHES = 4
+RECENT_PACKAGES_LIMIT = 5
+VIEW_READY_TIMEOUT = 1000
+
+recent_packages = []
+listing_executor = ThreadPoolExecutor(LISTING_WORKERS) if ThreadPoolExecutor is not None else None
+
+def plugin_loaded():
+    settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
+    update_instrumentation = lambda: set_instrumentation_enabled(settings.get("instrumentation", False))
+    settings.clear_on_change("instrumentation")
+    settings.add_on_change("instrumentation", update_instrumentation)
+    update_instrumentation()
+
 def no_packages_available_message():
     sublime.message_dialog("PackageResourceViewer\n\nThere are no more packages available to extract.")
 
@@ -32,33 +55,260 @@ def format_packages_list(packages_list, maximum_length=500):
 
     return ", ".join( contents )
 
+def format_size(size):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return "%.1f %s" % (size, unit) if unit != "B" else "%d B" % size
+        size /= 1024.0
+    return "%.1f GB" % size
+
+def format_extraction_report(report):
+    lines = ["PackageResourceViewer: extracted %s packages" % len(report["packages"]), ""]
+    for result in sorted(report["packages"], key=lambda result: result["package"]):
+        lines.append("%-40s %6d written %6d skipped %10s %8.2fs" % (
+            result["package"], result["members"], result["skipped"], format_size(result["bytes"]), result["time"]))
+
+    lines.append("")
+    lines.append(format_extraction_summary(report))
+    return "\n".join(lines) + "\n"
+
+def format_extraction_summary(report):
+    throughput = report["bytes"] / report["time"] if report["time"] > 0 else 0
+    summary = "%s packages, %s written in %.2fs (%s/s) using %s workers, %s unchanged members skipped" % (
+        len(report["packages"]), format_size(report["bytes"]), report["time"],
+        format_size(throughput), report["workers"], report["skipped"])
+    if report["linked"] > 0:
+        summary += ", %s members linked from the content store (%s not written)" % (
+            report["linked"], format_size(report["saved"]))
+    return summary
+
+def show_output_panel(window, name, text):
+    def show():
+        panel = create_output_panel(window, name)
+        panel.run_command("append", {"characters": text})
+    sublime.set_timeout(show, 0)
+
+def create_output_panel(window, name):
+    if IS_ST3:
+        panel = window.create_output_panel(name)
+    else:
+        panel = window.get_output_panel(name)
+    window.run_command("show_panel", {"panel": "output." + name})
+    return panel
+
+def append_to_panel(panel, text):
+    sublime.set_timeout(lambda: panel.run_command("append", {"characters": text, "force": True, "scroll_to_end": True}), 0)
+
+def extract_packages_with_report(window, packages, settings, incremental=None, deduplicate=None):
+    def on_extracted(result):
+        sublime.status_message("PackageResourceViewer: extracted %s" % result["package"])
+
+    if incremental is None:
+        incremental = settings.get("incremental_extract", False)
+    if deduplicate is None:
+        deduplicate = settings.get("deduplicate_extract", False)
+
+    report = extract_packages(packages, settings.get("extract_workers", 4), on_extracted, incremental, deduplicate)
+    text = format_extraction_report(report)
+    if deduplicate:
+        usage = get_extract_store_usage()
+        text += "Content store: %s files, %s, saving %s of disk space\n" % (
+            usage["files"], format_size(usage["bytes"]), format_size(usage["saved"]))
+    show_output_panel(window, "package_resource_viewer", text)
+    sublime.message_dialog("PackageResourceViewer\n\nSuccessfully extracted the packages:\n%s\n\n%s" % (
+            format_packages_list([result["package"] for result in report["packages"]], 1000),
+            format_extraction_summary(report) ) )
+
+def resume_interrupted_extraction(window, settings):
+    interrupted = get_interrupted_extraction()
+    if interrupted is None:
+        return False
+
+    packages = interrupted["packages"]
+    if not sublime.ok_cancel_dialog("PackageResourceViewer\n\nThe last extraction was interrupted before finishing:\n%s\n\nResume it?" % (
+            format_packages_list(packages, 1000) ), "Resume"):
+        discard_interrupted_extraction()
+        return False
+
+    extract_packages_with_report(window, packages, settings, interrupted["incremental"], interrupted["deduplicate"])
+    return True
+
+def remember_package(package):
+    if package in recent_packages:
+        recent_packages.remove(package)
+    recent_packages.insert(0, package)
+    del recent_packages[RECENT_PACKAGES_LIMIT:]
+
+class PackageListingPrefetcher(object):
+    """
+    Builds the ResourceTree of packages on a background worker, so the tree
+    of a package is usually ready by the time it is picked. Listings are
+    kept for a single run of a command.
+    """
+    def __init__(self, ignore_patterns):
+        self.ignore_patterns = ignore_patterns
+        self.lock = threading.Lock()
+        self.futures = {}
+
+    def prefetch(self, package, force=True):
+        if listing_executor is None:
+            return None
+
+        with self.lock:
+            future = self.futures.get(package)
+            if future is None:
+                pending = len([future for future in self.futures.values() if not future.done()])
+                if not force and pending >= MAX_PENDING_PREFETCHES:
+                    return None
+                future = listing_executor.submit(self.build_tree, package)
+                self.futures[package] = future
+        return future
+
+    def get(self, package, callback):
+        future = self.prefetch(package)
+        if future is None:
+            callback(self.build_tree(package))
+        else:
+            future.add_done_callback(lambda future: sublime.set_timeout(lambda: callback(future.result()), 0))
+
+    def build_tree(self, package):
+        return ResourceTree(list_package_files(package, self.ignore_patterns))
+
+class ViewReadyDispatcher(object):
+    """
+    Keeps callbacks per view id and runs each one once, when the view has
+    finished loading and, if wait_for_content is set, once the content
+    inserted by ChunkedContentInserter is complete. Views are checked on
+    on_load and when an insertion finishes, with a timer as a fallback for
+    events that are never delivered.
+    """
+    def __init__(self):
+        self.pending = {}
+
+    def when_ready(self, view, callback, wait_for_content=False):
+        waiting = view.id() in self.pending
+        self.pending.setdefault(view.id(), []).append((callback, wait_for_content))
+        self.notify(view)
+        if not waiting and view.id() in self.pending:
+            sublime.set_timeout(lambda: self.check(view), VIEW_READY_TIMEOUT)
+
+    def notify(self, view):
+        if view.id() not in self.pending or view.is_loading():
+            return
+
+        # Callbacks can insert content and notify again, so take them out
+        # of the pending list before running them.
+        callbacks = self.pending.pop(view.id())
+        remaining = []
+        for callback, wait_for_content in callbacks:
+            if wait_for_content and view.settings().get("buffer_empty", False):
+                remaining.append((callback, wait_for_content))
+            else:
+                callback(view)
+
+        if len(remaining) > 0:
+            self.pending[view.id()] = remaining + self.pending.get(view.id(), [])
+
+    def check(self, view):
+        if view.id() not in self.pending:
+            return
+        if hasattr(view, "is_valid") and not view.is_valid():
+            self.discard(view)
+            return
+        self.notify(view)
+        if view.id() in self.pending:
+            sublime.set_timeout(lambda: self.check(view), VIEW_READY_TIMEOUT)
+
+    def discard(self, view):
+        self.pending.pop(view.id(), None)
+
+view_ready_dispatcher = ViewReadyDispatcher()
+
+class ChunkedContentInserter(object):
+    """
+    Inserts content into a view a chunk at a time across timer ticks,
+    spending at most time_budget seconds per tick so the editor stays
+    responsive while a large resource loads. Chunks end on a line break
+    where possible, and "buffer_empty" is cleared after the last chunk.
+    """
+    def __init__(self, view, content, chunk_size, time_budget):
+        self.view = view
+        self.content = content
+        self.chunk_size = max(1, chunk_size)
+        self.time_budget = time_budget
+        self.position = 0
+
+    def start(self):
+        self.view.settings().set("buffer_empty", True)
+        self.insert_chunks()
+
+    def insert_chunks(self):
+        if hasattr(self.view, "is_valid") and not self.view.is_valid():
+            return
+
+        deadline = time.time() + self.time_budget
+        while self.position < len(self.content):
+            end = self.position + self.chunk_size
+            if end < len(self.content):
+                line_end = self.content.rfind("\n", self.position, end)
+                if line_end >= 0:
+                    end = line_end + 1
+            self.view.run_command("insert_content", {"content": self.content[self.position:end], "append": True})
+            self.position = end
+            if time.time() >= deadline:
+                break
+
+        if self.position < len(self.content):
+            sublime.set_timeout(self.insert_chunks, 1)
+        else:
+            self.view.settings().set("buffer_empty", False)
+            view_ready_dispatcher.notify(self.view)
+
 class PackageResourceViewerBase(sublime_plugin.WindowCommand):
     def run(self):
         self.previous_index = -1
         self.settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
-        self.packages = get_packages_list(True, self.settings.get("ignore_patterns", []))
+        self.prefetcher = PackageListingPrefetcher(self.settings.get("ignore_patterns", []))
         self.path = []
         self.path_objs = []
         self.path_index = []
-        self.show_quick_panel(self.packages, self.package_list_callback)
+        thread = threading.Thread(target=self.load_packages)
+        thread.start()
+
+    @instrumented
+    def load_packages(self):
+        self.packages = get_packages_list(True, self.settings.get("ignore_patterns", []))
+        for package in recent_packages:
+            if package in self.packages:
+                self.prefetcher.prefetch(package)
+        self.show_quick_panel(self.packages, self.package_list_callback, on_highlight=self.package_highlighted)
+
+    def package_highlighted(self, index):
+        for neighbour in range(max(0, index - 1), min(len(self.packages), index + 2)):
+            self.prefetcher.prefetch(self.packages[neighbour], force=False)
 
     def package_list_callback(self, index):
         if index == -1:
             return
 
         self.package = self.packages[index]
-        self.package_files = {}
-        self.quick_panel_files = self.create_quick_panel_file_list(self.package_files)
-        self.add_entry_to_path_obj()
+        remember_package(self.package)
         self.path_index.append(index)
+        self.prefetcher.get(self.package, self.show_package_tree)
+
+    @instrumented
+    def show_package_tree(self, package_tree):
+        self.package_tree = package_tree
+        self.add_entry_to_path_obj()
+        self.quick_panel_files = self.create_quick_panel_file_list(self.path_objs[-1])
         self.show_quick_panel(self.quick_panel_files, self.package_file_callback)
 
     def add_entry_to_path_obj(self, entry=""):
         if len(self.path_objs) == 0 and entry == "":
-            self.path_objs.append(self.package_files)
+            self.path_objs.append(self.package_tree.root)
         else:
             self.path.append(entry)
-            self.path_objs.append(self.path_objs[-1][entry])
+            self.path_objs.append(self.path_objs[-1].child(entry))
 
     def pop_entry_from_path_obj(self):
         if len(self.path_objs) > 0:
@@ -67,46 +317,15 @@ class PackageResourceViewerBase(sublime_plugin.WindowCommand):
             self.path_objs.pop()
 
     def is_file(self, entry):
-        return len(self.path_objs[-1][entry]) == 0
+        return not self.path_objs[-1].is_dir(entry)
 
-
-    def create_quick_panel_file_list(self, files_obj):
+    def create_quick_panel_file_list(self, node):
         quick_panel_files = [".."]
-        if len(files_obj) == 0:
-            ignore_patterns = self.settings.get("ignore_patterns", [])
-            files_list = list_package_files(self.package, ignore_patterns)
-            for entry in files_list:
-                self.create_file_entry(entry, self.package_files)
-            dirs, files = self.split_dirs_and_files(self.package_files)
-        else:
-            dirs, files = self.split_dirs_and_files(files_obj)
-
-        quick_panel_files += dirs
-        quick_panel_files += files
+        quick_panel_files += [name + "/" for name in node.dirs]
+        quick_panel_files += node.files
         return quick_panel_files
 
-    def create_file_entry(self, file_path, obj):
-        split_file = file_path.split("/", 1)
-        if len(split_file) > 1:
-            if split_file[0] not in obj:
-                obj[split_file[0]] = {}
-            self.create_file_entry(split_file[1], obj[split_file[0]])
-        else:
-            obj[file_path] = {}
-
-    def split_dirs_and_files(self, obj):
-        files = []
-        dirs = []
-
-        for key in obj.keys():
-            entry = obj[key]
-            if len(entry) == 0:
-                files.append(key)
-            else:
-                dirs.append(key + "/")
-
-        return sorted(dirs), sorted(files)
-
+    @instrumented
     def package_file_callback(self, index):
         if index == -1:
             return
@@ -117,7 +336,7 @@ class PackageResourceViewerBase(sublime_plugin.WindowCommand):
                 index = self.path_index.pop()
             self.pop_entry_from_path_obj()
             if len(self.path_objs) == 0:
-                self.show_quick_panel(self.packages, self.package_list_callback, index)
+                self.show_quick_panel(self.packages, self.package_list_callback, index, self.package_highlighted)
             else:
                 self.quick_panel_files = self.create_quick_panel_file_list(self.path_objs[-1])
                 self.show_quick_panel(self.quick_panel_files, self.package_file_callback, index)
@@ -127,7 +346,8 @@ class PackageResourceViewerBase(sublime_plugin.WindowCommand):
             if self.is_file(entry):
                 self.pre_open_file_setup(entry)
                 view = self.open_file(self.package, "/".join(self.path + [entry]))
-                sublime.set_timeout(lambda: self.setup_view(view), 10)
+                if view is not None:
+                    view_ready_dispatcher.when_ready(view, self.setup_view, True)
                 if self.settings.get("open_multiple", False):
                     self.show_quick_panel(self.quick_panel_files, self.package_file_callback)
             else:
@@ -141,23 +361,33 @@ class PackageResourceViewerBase(sublime_plugin.WindowCommand):
     def setup_view(self, view):
         pass
 
-    def show_quick_panel(self, options, done_callback, index=None):
-        if index is None or not IS_ST3 or not self.settings.get("return_to_previous", False):
+    def show_quick_panel(self, options, done_callback, index=None, on_highlight=None):
+        if not IS_ST3:
             sublime.set_timeout(lambda: self.window.show_quick_panel(options, done_callback), 10)
-        else:
-            sublime.set_timeout(lambda: self.window.show_quick_panel(options, done_callback, selected_index=index), 10)
+            return
+
+        if index is None or not self.settings.get("return_to_previous", False):
+            index = -1
+        sublime.set_timeout(lambda: self.window.show_quick_panel(options, done_callback, 0, index, on_highlight), 10)
 
+    @instrumented
     def open_file(self, package, resource):
         resource_path = os.path.join(sublime.packages_path(), package, resource)
         view = self.find_open_file(resource_path)
         if view:
             self.window.focus_view(view)
         else:
-            view = self.window.open_file(resource_path)
+            content = None
             if not os.path.exists(resource_path):
                 content = get_resource(package, resource)
+                if content is None:
+                    sublime.status_message("PackageResourceViewer: %s/%s not found" % (package, resource))
+                    return None
+
+            view = self.window.open_file(resource_path)
+            if content is not None:
                 view.settings().set("buffer_empty", True)
-                sublime.set_timeout(lambda: self.insert_text(content, view), 10)
+                view_ready_dispatcher.when_ready(view, lambda view: self.insert_text(content, view))
                 if self.settings.get("single_command", True):
                     view.settings().set("create_dir", True)
                     view.set_scratch(True)
@@ -165,11 +395,8 @@ class PackageResourceViewerBase(sublime_plugin.WindowCommand):
         return view
 
     def insert_text(self, content, view):
-        if not view.is_loading():
-            view.run_command("insert_content", {"content": content})
-            view.settings().set("buffer_empty", False)
-        else:
-            sublime.set_timeout(lambda: self.insert_text(content, view), 10)
+        ChunkedContentInserter(view, content, self.settings.get("insert_chunk_size", 65536),
+            self.settings.get("insert_time_budget_ms", 10) / 1000.0).start()
 
     def find_open_file(self, path):
         view = None
@@ -186,11 +413,8 @@ class PackageResourceViewerCommand(PackageResourceViewerBase):
 
 class ViewPackageFileCommand(PackageResourceViewerBase):
     def setup_view(self, view):
-        if not view.is_loading():
-            view.set_read_only(True)
-            view.set_scratch(True)
-        else:
-            sublime.set_timeout(lambda: self.setup_view(view), 10)
+        view.set_read_only(True)
+        view.set_scratch(True)
 
     def is_visible(self):
         settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
@@ -209,17 +433,20 @@ class EditPackageFileCommand(PackageResourceViewerBase):
                 raise
 
     def setup_view(self, view):
-        if not view.is_loading():
-            view.set_read_only(False)
-            view.run_command("save")
-        else:
-            sublime.set_timeout(lambda: self.setup_view(view), 15)
+        view.set_read_only(False)
+        view.run_command("save")
 
     def is_visible(self):
         settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
         return not settings.get("single_command", True)
 
 class PackageResourceViewerEvents(sublime_plugin.EventListener):
+    def on_load(self, view):
+        view_ready_dispatcher.notify(view)
+
+    def on_close(self, view):
+        view_ready_dispatcher.discard(view)
+
     def on_pre_save(self, view):
         if view.settings().get("create_dir", False):
             if not os.path.exists(view.file_name()):
@@ -240,6 +467,34 @@ class PackageResourceViewerEvents(sublime_plugin.EventListener):
             if ex.errno != errno.EEXIST:
                 raise
 
+class GoToPackageResourceCommand(PackageResourceViewerBase):
+    def run(self, query=None):
+        self.settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
+        self.query = query
+        thread = threading.Thread(target=self.load_resources)
+        thread.start()
+
+    def load_resources(self):
+        table = get_resource_path_table(self.settings.get("ignore_patterns", []))
+        if self.query:
+            self.resource_paths = table.search(self.query)
+        else:
+            self.resource_paths = table.paths
+        self.show_quick_panel(self.resource_paths, self.resource_callback)
+
+    @instrumented
+    def resource_callback(self, index):
+        if index == -1:
+            return
+
+        package, resource = self.resource_paths[index].split("/", 1)
+        remember_package(package)
+        view = self.open_file(package, resource)
+        if view is not None:
+            view_ready_dispatcher.when_ready(view, self.setup_view, True)
+        if self.settings.get("open_multiple", False):
+            self.show_quick_panel(self.resource_paths, self.resource_callback, index)
+
 class ExtractPackageCommand(sublime_plugin.WindowCommand):
     def run(self):
         thread = ExtractPackagesThread(self.window)
@@ -249,6 +504,8 @@ class ExtractPackageCommand(sublime_plugin.WindowCommand):
         return VERSION >= 3006
 
 class ExtractPackagesThread(threading.Thread):
+    action_name = "Extraction"
+    action_verb = "extract"
 
     def __init__(self, window):
         threading.Thread.__init__(self)
@@ -261,8 +518,15 @@ class ExtractPackagesThread(threading.Thread):
 
     def run(self):
         self.settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
+        if resume_interrupted_extraction(self.window, self.settings):
+            return
+
+        self.show_packages( get_sublime_packages(True, self.settings.get("ignore_patterns", []),
+            self.settings.get("incremental_extract", False)) )
+
+    def show_packages(self, packages):
         self.repositories_list = [""]
-        self.repositories_list.extend( get_sublime_packages(True, self.settings.get("ignore_patterns", [])) )
+        self.repositories_list.extend( packages )
 
         if len( self.repositories_list ) < 2:
             no_packages_available_message()
@@ -296,20 +560,7 @@ class ExtractPackagesThread(threading.Thread):
 
                     packages.append( package_name )
 
-                def extract():
-                    packages_path = sublime.packages_path()
-
-                    for package_name in packages:
-                        full_path = os.path.join(packages_path, package_name, '.extracted-sublime-package')
-
-                        if not os.path.exists(full_path):
-                            extract_package(package_name)
-
-                    sublime.message_dialog("PackageResourceViewer\n\nSuccessfully extracted the packages:\n%s" % (
-                            format_packages_list(packages, 1000) ) )
-
-                thread = threading.Thread( target=extract )
-                thread.start()
+                self.process_packages( packages )
 
         else:
 
@@ -340,18 +591,68 @@ class ExtractPackagesThread(threading.Thread):
 
             show_quick_panel( self.window, self.repositories_list, self.on_done )
 
+    def process_packages(self, packages):
+
+        def extract():
+            packages_path = sublime.packages_path()
+            incremental = self.settings.get("incremental_extract", False)
+            pending = []
+
+            for package_name in packages:
+                full_path = os.path.join(packages_path, package_name, '.extracted-sublime-package')
+
+                if incremental or not os.path.exists(full_path):
+                    pending.append(package_name)
+
+            extract_packages_with_report(self.window, pending, self.settings)
+
+        thread = threading.Thread( target=extract )
+        thread.start()
+
     def update_start_item_name(self):
         items = self.get_total_items_selected()
 
         if items:
-            self.repositories_list[0] = "Start Extraction (%s of %s items selected)" % ( items, len( self.repositories_list ) - 1 )
+            self.repositories_list[0] = "Start %s (%s of %s items selected)" % ( self.action_name, items, len( self.repositories_list ) - 1 )
 
         else:
-            self.repositories_list[0] = "Select all the packages you would like to extract"
+            self.repositories_list[0] = "Select all the packages you would like to %s" % self.action_verb
 
     def get_total_items_selected(self):
         return self.last_picked_item - self.last_excluded_items
 
+class ExportPackagesCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        thread = ExportPackagesThread(self.window)
+        thread.start()
+
+class ExportPackagesThread(ExtractPackagesThread):
+    action_name = "Export"
+    action_verb = "export"
+
+    def run(self):
+        self.settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
+        self.show_packages( get_packages_list(True, self.settings.get("ignore_patterns", [])) )
+
+    def process_packages(self, packages):
+        self.packages = packages
+        default_path = os.path.join(os.path.expanduser("~"), "sublime-packages.zip")
+        self.window.show_input_panel("Export packages to (.zip, .tar, .tar.gz or .tar.bz2):", default_path,
+            self.on_output_path, None, None)
+
+    def on_output_path(self, output_path):
+        def export():
+            report = export_packages(self.packages, os.path.expanduser(output_path),
+                self.settings.get("ignore_patterns", []),
+                lambda package: sublime.status_message("PackageResourceViewer: exported %s" % package))
+            sublime.message_dialog("PackageResourceViewer\n\nSuccessfully exported the packages:\n%s\n\n"
+                "%s members (%s copied without recompressing), %s written in %.2fs" % (
+                    format_packages_list(report["packages"], 1000), report["members"], report["copied"],
+                    format_size(report["bytes"]), report["time"] ) )
+
+        thread = threading.Thread( target=export )
+        thread.start()
+
 class ExtractAllPackagesCommand(sublime_plugin.WindowCommand):
     def run(self):
         thread = ExtractAllPackagesThread(self.window)
@@ -373,8 +674,12 @@ class ExtractAllPackagesThread(threading.Thread):
 
     def run(self):
         self.settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
+        if resume_interrupted_extraction(self.window, self.settings):
+            return
+
         self.repositories_list = [""]
-        self.packages = get_sublime_packages(True, self.settings.get("ignore_patterns", []))
+        self.packages = get_sublime_packages(True, self.settings.get("ignore_patterns", []),
+            self.settings.get("incremental_extract", False))
         self.repositories_list.extend( self.packages )
 
         if len( self.repositories_list ) < 2:
@@ -397,7 +702,6 @@ class ExtractAllPackagesThread(threading.Thread):
 
             else:
                 packages = set()
-                extracted = []
 
                 for index in range( 1, self.last_picked_item + 1 ):
                     package_name = self.repositories_list[index]
@@ -412,18 +716,18 @@ class ExtractAllPackagesThread(threading.Thread):
 
                 def extract():
                     packages_path = sublime.packages_path()
+                    incremental = self.settings.get("incremental_extract", False)
+                    pending = []
 
                     for package_name in self.packages:
 
                         if package_name not in packages:
                             full_path = os.path.join(packages_path, package_name, '.extracted-sublime-package')
 
-                            if not os.path.exists(full_path):
-                                extracted.append(package_name)
-                                extract_package(package_name)
+                            if incremental or not os.path.exists(full_path):
+                                pending.append(package_name)
 
-                    sublime.message_dialog("PackageResourceViewer\n\nSuccessfully extracted the packages:\n%s" % (
-                            format_packages_list(extracted, 1000) ) )
+                    extract_packages_with_report(self.window, pending, self.settings)
 
                 thread = threading.Thread( target=extract )
                 thread.start()
@@ -465,6 +769,112 @@ class ExtractAllPackagesThread(threading.Thread):
     def get_total_items_selected(self):
         return self.last_picked_item - self.last_excluded_items
 
+class SearchPackageResourcesCommand(sublime_plugin.WindowCommand):
+    def run(self, pattern=None):
+        if pattern is None:
+            self.window.show_input_panel("Search package resources:", "", self.search, None, None)
+        else:
+            self.search(pattern)
+
+    def search(self, pattern):
+        try:
+            compiled_pattern = re.compile(pattern, re.MULTILINE)
+        except re.error as ex:
+            sublime.status_message("PackageResourceViewer: invalid pattern (%s)" % ex)
+            return
+
+        panel = create_output_panel(self.window, "package_resource_search")
+        panel.settings().set("result_file_regex", r"^(Packages/.+?):(\d+): ")
+        panel.settings().set("result_base_dir", os.path.dirname(sublime.packages_path()))
+        panel.run_command("append", {"characters": "Searching package resources for %s\n\n" % pattern})
+
+        settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
+        thread = threading.Thread(target=self.search_thread, args=(panel, compiled_pattern, settings.get("ignore_patterns", [])))
+        thread.start()
+
+    def search_thread(self, panel, pattern, ignore_patterns):
+        start_time = time.time()
+        flush_time = start_time
+        count = 0
+        lines = []
+
+        for package, resource, line_number, line in iter_search_resources(pattern, ignore_patterns=ignore_patterns):
+            count += 1
+            lines.append("Packages/%s/%s:%d: %s\n" % (package, resource, line_number, line.strip()[:200]))
+            if time.time() - flush_time > 0.1:
+                append_to_panel(panel, "".join(lines))
+                lines = []
+                flush_time = time.time()
+
+        lines.append("\n%s matches in %.2fs\n" % (count, time.time() - start_time))
+        append_to_panel(panel, "".join(lines))
+
+class ShowPackageOverridesCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        settings = sublime.load_settings("PackageResourceViewer.sublime-settings")
+        panel = create_output_panel(self.window, "package_resource_overrides")
+        panel.settings().set("result_file_regex", r"^\s+\w+\s+(Packages/.+)$")
+        panel.settings().set("result_base_dir", os.path.dirname(sublime.packages_path()))
+        panel.run_command("append", {"characters": "Comparing package overrides with their package archives\n\n"})
+
+        thread = threading.Thread(target=self.report_thread, args=(panel, settings.get("ignore_patterns", [])))
+        thread.start()
+
+    def report_thread(self, panel, ignore_patterns):
+        start_time = time.time()
+        report = get_override_report(ignore_patterns=ignore_patterns)
+        lines = []
+        totals = {"identical": 0, "modified": 0, "orphaned": 0}
+        packages = {}
+
+        for package, resource, status in report:
+            totals[status] += 1
+            if package not in packages:
+                packages[package] = {"identical": 0, "modified": 0, "orphaned": 0, "changed": []}
+            packages[package][status] += 1
+            if status != "identical":
+                packages[package]["changed"].append("    %-10s Packages/%s/%s" % (status, package, resource))
+
+        for package in sorted(packages):
+            counts = packages[package]
+            lines.append("%s: %s identical, %s modified, %s orphaned" % (
+                package, counts["identical"], counts["modified"], counts["orphaned"]))
+            lines.extend(counts["changed"])
+
+        lines.append("")
+        lines.append("%s identical, %s modified, %s orphaned overrides in %.2fs" % (
+            totals["identical"], totals["modified"], totals["orphaned"], time.time() - start_time))
+        append_to_panel(panel, "\n".join(lines) + "\n")
+
+class PackageResourceViewerStatsCommand(sublime_plugin.WindowCommand):
+    def run(self, output="panel", reset=False):
+        stats = get_instrumentation_stats()
+        if output == "json":
+            view = self.window.new_file()
+            view.set_name("PackageResourceViewer Statistics.json")
+            view.set_scratch(True)
+            view.run_command("insert_content", {"content": json.dumps(stats, indent=4, sort_keys=True)})
+        else:
+            show_output_panel(self.window, "package_resource_viewer", self.format_stats(stats))
+
+        if reset:
+            reset_instrumentation_stats()
+
+    def format_stats(self, stats):
+        lines = ["PackageResourceViewer statistics (instrumentation %s)" % ("enabled" if stats["enabled"] else "disabled"), ""]
+        lines.append("%-50s %8s %10s %10s %10s" % ("timing", "calls", "total ms", "mean ms", "p95 ms"))
+        for name, timing in sorted(stats["timings"].items(), key=lambda item: -item[1]["total"]):
+            lines.append("%-50s %8d %10.2f %10.3f %10.3f" % (
+                name, timing["calls"], timing["total"] * 1000, timing["mean"] * 1000, timing["p95"] * 1000))
+
+        lines.append("")
+        for name, value in sorted(stats["counters"].items()):
+            lines.append("%-50s %8d" % (name, value))
+        return "\n".join(lines) + "\n"
+
 class InsertContentCommand(sublime_plugin.TextCommand):
-    def run(self, edit, content):
-        self.view.insert(edit, 0, content)
+    def run(self, edit, content, append=False):
+        self.view.insert(edit, self.view.size() if append else 0, content)
+
+if not IS_ST3:
+    plugin_loaded()
@@ -10,31 +10,347 @@ import zipfile
 import tempfile
 import re
 import codecs
+import json
+import threading
+import time
+import shutil
+import tarfile
+import errno
+import zlib
+import io
+import struct
+import hashlib
+import mmap
+import sys
+import functools
+import contextlib
+import bisect
+import inspect
+from array import array
+from collections import deque
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+except ImportError:
+    ThreadPoolExecutor = None
 
 __all__ = [
     "get_resource",
     "get_binary_resource",
+    "get_resources",
+    "get_binary_resources",
+    "iter_resources",
+    "open_resource_stream",
+    "iter_resource_chunks",
+    "get_binary_resource_view",
     "find_resource",
+    "iter_find_resource",
+    "iter_search_resources",
     "list_package_files",
+    "ResourceTree",
+    "ResourcePathTable",
+    "get_resource_path_table",
     "get_package_and_resource_name",
+    "resolve_resource",
+    "resolve_resources",
     "get_packages_list",
     "extract_package",
-    "get_sublime_packages"
+    "extract_packages",
+    "export_packages",
+    "get_extract_store_usage",
+    "get_interrupted_extraction",
+    "discard_interrupted_extraction",
+    "get_sublime_packages",
+    "get_override_report",
+    "instrumented",
+    "set_instrumentation_enabled",
+    "get_instrumentation_stats",
+    "reset_instrumentation_stats"
 ]
 
 
 VERSION = int(sublime.version())
 
+INDEX_VERSION = 1
+INDEX_SAVE_DELAY = 2.0
+INDEX_RACY_WINDOW = 2.0
+
+FIND_RESOURCE_WORKERS = 4
+EXTRACT_WORKERS = 4
+SEARCH_WORKERS = 4
+SEARCH_MAX_SIZE = 4 * 1024 * 1024
+EXTRACTED_MARKER = ".extracted-sublime-package"
+
+RESOURCE_CHUNK_SIZE = 65536
+RESOURCE_CACHE_BYTES = 8 * 1024 * 1024
+
+INSTRUMENTATION_SAMPLES = 1024
+
+ZIP_POOL_SIZE = 16
+ZIP_POOL_IDLE_TIMEOUT = 30.0
+
+_resource_index = None
+_resource_index_lock = threading.Lock()
+_ignore_matchers = {}
+_path_tables = {}
+_package_roots = None
+_path_tables_lock = threading.Lock()
+_extraction_lock = threading.Lock()
+_newline_pattern = re.compile(r"\r\n?")
+
+_clock = getattr(time, "perf_counter", time.time)
+
+class _Instrumentation(object):
+    """
+    Call counts, latencies and counters recorded by instrumented functions
+    and the _start_timer/_stop_timer/_count hooks. Nothing is recorded
+    while disabled, so the hooks only cost an attribute check.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.timings = {}
+            self.counters = {}
+
+    def record(self, name, elapsed):
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = {"calls": 0, "total": 0.0, "samples": deque(maxlen=INSTRUMENTATION_SAMPLES)}
+            timing["calls"] += 1
+            timing["total"] += elapsed
+            timing["samples"].append(elapsed)
+
+    def count(self, name, amount):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def stats(self):
+        with self.lock:
+            timings = {}
+            for name, timing in self.timings.items():
+                samples = sorted(timing["samples"])
+                timings[name] = {
+                    "calls": timing["calls"],
+                    "total": timing["total"],
+                    "mean": timing["total"] / timing["calls"],
+                    "p95": samples[int(0.95 * (len(samples) - 1))]
+                }
+            return {"enabled": self.enabled, "timings": timings, "counters": dict(self.counters)}
+
+_instrumentation = _Instrumentation()
+
+def set_instrumentation_enabled(enabled):
+    _instrumentation.enabled = bool(enabled)
+
+def get_instrumentation_stats():
+    """
+    Return the recorded statistics as a JSON serializable dict. Timings
+    (in seconds) have the call count, total, mean and p95 latency.
+    """
+    return _instrumentation.stats()
+
+def reset_instrumentation_stats():
+    _instrumentation.reset()
+
+def instrumented(function):
+    """
+    Decorator recording the call count and latency of a function while
+    instrumentation is enabled. For generator functions the time spent
+    producing each item is recorded.
+    """
+    name = getattr(function, "__qualname__", function.__name__)
+
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            if not _instrumentation.enabled:
+                for item in function(*args, **kwargs):
+                    yield item
+                return
+
+            elapsed = 0.0
+            start = _clock()
+            try:
+                for item in function(*args, **kwargs):
+                    elapsed += _clock() - start
+                    yield item
+                    start = _clock()
+                elapsed += _clock() - start
+            finally:
+                _instrumentation.record(name, elapsed)
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _instrumentation.enabled:
+            return function(*args, **kwargs)
+
+        start = _clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _instrumentation.record(name, _clock() - start)
+    return wrapper
+
+def _start_timer():
+    return _clock() if _instrumentation.enabled else None
+
+def _stop_timer(name, start):
+    if start is not None:
+        _instrumentation.record(name, _clock() - start)
+
+def _count(name, amount=1):
+    if _instrumentation.enabled:
+        _instrumentation.count(name, amount)
+
+def plugin_loaded():
+    threading.Thread(target=_get_index).start()
+
+def plugin_unloaded():
+    _zip_pool.close()
+
+@instrumented
 def get_resource(package_name, resource, encoding="utf-8"):
     return _get_resource(package_name, resource, encoding=encoding)
 
+@instrumented
 def get_binary_resource(package_name, resource):
     return _get_resource(package_name, resource, return_binary=True)
 
 def _get_resource(package_name, resource, return_binary=False, encoding="utf-8"):
-    packages_path = sublime.packages_path()
+    key = (package_name, resource, return_binary, encoding)
+    signature = _get_resource_signature(package_name, resource)
+    content = _content_cache.get(key, signature)
+    if content is None:
+        _count("content_cache.misses")
+        content = _load_resource(package_name, resource, return_binary, encoding)
+        if content is not None:
+            if not return_binary:
+                start = _start_timer()
+                content = _normalize_newlines(content)
+                _stop_timer("normalize_newlines", start)
+            _content_cache.put(key, signature, content, _get_content_cache_budget())
+
+    return content
+
+def _get_content_cache_budget():
+    return sublime.load_settings("PackageResourceViewer.sublime-settings").get(
+        "resource_cache_bytes", RESOURCE_CACHE_BYTES)
+
+def _get_resource_signature(package_name, resource, archive_stats=None):
+    """
+    Return the size and mtime of every source that could supply the
+    resource, so any change to them invalidates cached content. Archive
+    stats can be shared between calls through the archive_stats dict.
+    """
+    signature = [_get_stat_signature(_get_stat(os.path.join(sublime.packages_path(), package_name, resource)))]
+    for path in _get_package_archive_paths(package_name):
+        if archive_stats is None:
+            signature.append(_get_stat_signature(_get_stat(path)))
+        else:
+            if path not in archive_stats:
+                archive_stats[path] = _get_stat_signature(_get_stat(path))
+            signature.append(archive_stats[path])
+    return tuple(signature)
+
+def _get_stat_signature(stat):
+    return None if stat is None else (stat.st_size, stat.st_mtime)
+
+def get_resources(resources, encoding="utf-8"):
+    """
+    Return a dict mapping each (package, resource) pair to its content, or
+    None if the resource does not exist. See iter_resources.
+    """
+    return dict(iter_resources(resources, encoding=encoding))
+
+def get_binary_resources(resources):
+    return dict(iter_resources(resources, return_binary=True))
+
+@instrumented
+def iter_resources(resources, return_binary=False, encoding="utf-8"):
+    """
+    Load many resources at once, yielding ((package, resource), content)
+    pairs. Requests are grouped by the loose folder or archive supplying
+    them, and each archive is opened once and read in central directory
+    order. Cached content is yielded first, then loose files, then the
+    members of each archive. Content is None for missing resources.
+
+    Arguments:
+    resources       Iterable of (package, resource) pairs.
+    return_binary   Return bytes instead of decoded, newline normalized text.
+    encoding        Encoding used to decode text content.
+    """
+    archive_stats = {}
+    loose = []
+    archives = {}
+    archive_requests = []
+    budget = _get_content_cache_budget()
+
+    try:
+        for package_name, resource in resources:
+            key = (package_name, resource, return_binary, encoding)
+            signature = _get_resource_signature(package_name, resource, archive_stats)
+            content = _content_cache.get(key, signature)
+            if content is not None:
+                yield (package_name, resource), content
+                continue
+
+            path = os.path.join(sublime.packages_path(), package_name, resource)
+            if signature[0] is not None and os.path.isfile(path):
+                loose.append((key, signature, path))
+                continue
+
+            for path_to_zip, stat_signature in zip(_get_package_archive_paths(package_name), signature[1:]):
+                if stat_signature is not None:
+                    if path_to_zip not in archives:
+                        archives[path_to_zip] = (_zip_pool.acquire(path_to_zip), [])
+                        archive_requests.append(archives[path_to_zip])
+                    archive, requests = archives[path_to_zip]
+                    if archive is not None and resource in archive.members:
+                        requests.append((key, signature, archive.members[resource]))
+                        break
+            else:
+                yield (package_name, resource), None
+
+        for key, signature, path in loose:
+            content = _get_directory_item_content(path, return_binary, encoding)
+            yield key[:2], _cache_loaded_content(key, signature, content, return_binary, budget)
+
+        for archive, requests in archive_requests:
+            requests.sort(key=lambda request: request[2].header_offset)
+            for key, signature, info in requests:
+                with archive.lock:
+                    content = archive.zip_file.read(info)
+                _count("bytes_read", len(content))
+                if not return_binary:
+                    content = content.decode(encoding)
+                yield key[:2], _cache_loaded_content(key, signature, content, return_binary, budget)
+    finally:
+        for archive, requests in archive_requests:
+            if archive is not None:
+                _zip_pool.release(archive)
+
+def _cache_loaded_content(key, signature, content, return_binary, budget):
+    _count("content_cache.misses")
+    if not return_binary:
+        content = _normalize_newlines(content)
+    _content_cache.put(key, signature, content, budget)
+    return content
+
+def _normalize_newlines(content):
+    if "\r" not in content:
+        return content
+    return _newline_pattern.sub("\n", content)
+
+def _load_resource(package_name, resource, return_binary, encoding):
     content = None
     if VERSION > 3013:
+        start = _start_timer()
         try:
             if return_binary:
                 content = sublime.load_binary_resource("Packages/" + package_name + "/" + resource)
@@ -42,96 +358,675 @@ def _get_resource(package_name, resource, return_binary=False, encoding="utf-8")
                 content = sublime.load_resource("Packages/" + package_name + "/" + resource)
         except IOError:
             pass
+        _stop_timer("sublime.load_resource", start)
     else:
-        path = None
-        if os.path.exists(os.path.join(packages_path, package_name, resource)):
-            path = os.path.join(packages_path, package_name, resource)
-            content = _get_directory_item_content(path, return_binary, encoding)
+        resource = resource.replace("\\", "/")
+        layers = _resolution_map.get_resource_layers(package_name, resource)
+        if layers is not None:
+            location = _resolution_map.get_locations(package_name, resource, layers[:1])[0]
+            if layers[0] == 0:
+                content = _get_directory_item_content(location, return_binary, encoding)
+            else:
+                content = _get_zip_item_content(location, resource, return_binary, encoding)
 
-        if VERSION >= 3006:
-            sublime_package = package_name + ".sublime-package"
+    return content
+
+@instrumented
+def open_resource_stream(package_name, resource):
+    """
+    Open a resource as a binary file-like object without reading it into
+    memory. Loose files and stored archive members support seek, so ranges
+    can be read cheaply. The caller is responsible for closing the stream.
 
-            packages_path = sublime.installed_packages_path()
-            if content is None:
-                if os.path.exists(os.path.join(packages_path, sublime_package)):
-                    content = _get_zip_item_content(os.path.join(packages_path, sublime_package), resource, return_binary, encoding)
+    Returns None if the resource does not exist.
+    """
+    path = os.path.join(sublime.packages_path(), package_name, resource)
+    if os.path.isfile(path):
+        return open(path, "rb")
+
+    for path_to_zip in _get_package_archive_paths(package_name):
+        with _pinned_archive(path_to_zip) as archive:
+            if archive is not None and resource in archive.members:
+                return _open_zip_member(archive, resource)
+
+    return None
+
+@instrumented
+def iter_resource_chunks(package_name, resource, chunk_size=RESOURCE_CHUNK_SIZE, start=0, end=None):
+    """
+    Yield the bytes of a resource in chunks of at most chunk_size bytes.
+
+    Arguments:
+    package_name    Name of the package containing the resource.
+    resource        "/" separated path of the resource in the package.
+    chunk_size      Maximum size of each chunk.
+    start           Offset of the first byte to read.
+    end             Offset to stop reading at. Reads to the end if None.
+    """
+    stream = open_resource_stream(package_name, resource)
+    if stream is None:
+        return
+
+    with stream:
+        if start > 0:
+            if stream.seekable():
+                stream.seek(start)
+            else:
+                _skip_bytes(stream, start, chunk_size)
 
-            packages_path = os.path.dirname(sublime.executable_path()) + os.sep + "Packages"
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = stream.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+def _skip_bytes(stream, count, chunk_size):
+    while count > 0:
+        chunk = stream.read(min(chunk_size, count))
+        if not chunk:
+            break
+        count -= len(chunk)
+
+def _get_package_archive_paths(package_name):
+    """
+    Return the possible archive locations of a package, in the order
+    Sublime Text resolves them.
+    """
+    if VERSION < 3006:
+        return []
 
-            if content is None:
-                if os.path.exists(os.path.join(packages_path, sublime_package)):
-                    content = _get_zip_item_content(os.path.join(packages_path, sublime_package), resource, return_binary, encoding)
+    sublime_package = package_name + ".sublime-package"
+    return [
+        os.path.join(sublime.installed_packages_path(), sublime_package),
+        os.path.join(os.path.dirname(sublime.executable_path()), "Packages", sublime_package)
+    ]
 
-    return content.replace("\r\n", "\n").replace("\r", "\n")
+@instrumented
+def get_binary_resource_view(package_name, resource):
+    """
+    Return a read-only memoryview of a resource's bytes, or None if the
+    resource does not exist. Loose files and stored archive members are
+    memory-mapped and sliced without copying; compressed members are
+    decompressed in chunks into a single buffer. Release the view when done
+    with it, since a mapped file cannot be replaced on Windows.
+    """
+    path = os.path.join(sublime.packages_path(), package_name, resource)
+    if os.path.isfile(path):
+        return _map_file(path, 0, os.path.getsize(path))
+
+    for path_to_zip in _get_package_archive_paths(package_name):
+        with _pinned_archive(path_to_zip) as archive:
+            if archive is not None and resource in archive.members:
+                return _get_member_view(archive, resource)
+
+    return None
+
+def _get_member_view(archive, resource):
+    info = archive.members[resource]
+    if info.compress_type == zipfile.ZIP_STORED:
+        return _map_file(archive.path, archive.data_offset(info), info.file_size)
+
+    buffer = bytearray(info.file_size)
+    view = memoryview(buffer)
+    position = 0
+    with _open_zip_member(archive, resource) as stream:
+        while position < info.file_size:
+            chunk = stream.read(min(RESOURCE_CHUNK_SIZE, info.file_size - position))
+            if not chunk:
+                break
+            view[position:position + len(chunk)] = chunk
+            position += len(chunk)
+    _count("bytes_read", position)
+    view = view[:position]
+    return view.toreadonly() if hasattr(view, "toreadonly") else view
+
+def _map_file(path, offset, size):
+    if size == 0:
+        return memoryview(b"")
+    with open(path, "rb") as file_obj:
+        mapped_file = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+    _count("mmaps")
+    return memoryview(mapped_file)[offset:offset + size]
+
+def _open_zip_member(archive, name):
+    info = archive.members[name]
+    if info.compress_type == zipfile.ZIP_STORED:
+        return io.BufferedReader(_StoredMemberStream(archive.path, archive.data_offset(info), info.file_size), RESOURCE_CHUNK_SIZE)
+
+    with archive.lock:
+        return archive.zip_file.open(info)
+
+def _get_member_data_offset(file_obj, info):
+    """
+    Return the offset of a member's data, read from its local file header
+    since the extra field may differ from the central directory.
+    """
+    return _read_local_header_end(file_obj, info.header_offset, info.filename)
 
+def _read_local_header_end(file_obj, header_offset, name):
+    file_obj.seek(header_offset)
+    header = file_obj.read(30)
+    if len(header) != 30 or header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipfile("Bad local file header for %s" % name)
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    return header_offset + 30 + name_length + extra_length
 
+class _StoredMemberStream(io.RawIOBase):
+    """
+    Seekable, read-only stream over an uncompressed archive member, reading
+    directly from its own handle on the archive.
+    """
+    def __init__(self, path, start, size):
+        io.RawIOBase.__init__(self)
+        self.file_obj = open(path, "rb")
+        self.start = start
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = max(0, offset)
+        return self.position
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.size - self.position)
+        if count <= 0:
+            return 0
+        self.file_obj.seek(self.start + self.position)
+        data = self.file_obj.read(count)
+        _count("bytes_read", len(data))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.file_obj.close()
+        io.RawIOBase.close(self)
+
+
+@instrumented
 def find_resource(resource_pattern, package=None):
+    return sorted(set(iter_find_resource(resource_pattern, package)))
+
+@instrumented
+def iter_find_resource(resource_pattern, package=None, max_workers=FIND_RESOURCE_WORKERS):
+    """
+    Yield "<package>/<resource>" entries matching the pattern as they are
+    found. When no package is specified, packages are scanned on a thread
+    pool, so entries are yielded in no particular order.
+
+    Arguments:
+    resource_pattern    Regular expression (or compiled pattern) to search for.
+    package             Package to search. All packages are searched if None.
+    max_workers         Number of threads used to scan the packages.
+    """
+    pattern = re.compile(resource_pattern)
+    if package is not None:
+        for entry in _find_package_resource(package, pattern):
+            yield entry
+        return
+
+    for entries in _iter_package_results(get_packages_list(), max_workers, _find_package_resource, pattern):
+        for entry in entries:
+            yield entry
+
+def _iter_package_results(packages, max_workers, function, *args):
+    """
+    Call function(package, *args) for every package on a thread pool and
+    yield the results as they complete. Pending calls are cancelled if the
+    generator is closed early.
+    """
+    if ThreadPoolExecutor is None or max_workers < 2:
+        for package in packages:
+            yield function(package, *args)
+        return
+
+    executor = ThreadPoolExecutor(max_workers)
+    futures = [executor.submit(function, package, *args) for package in packages]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(False)
+
+def _find_package_resource(package, pattern):
     file_set = set()
-    if package == None:
-        for package in get_packages_list():
-            file_set.update(find_resource(resource_pattern, package))
+    file_set.update(_find_directory_resource(os.path.join(sublime.packages_path(), package), pattern))
 
-        ret_list = list(file_set)
-    else:
-        file_set.update(_find_directory_resource(os.path.join(sublime.packages_path(), package), resource_pattern))
+    if VERSION >= 3006:
+        zip_location = os.path.join(sublime.installed_packages_path(), package + ".sublime-package")
+        file_set.update(_find_zip_resource(zip_location, pattern))
+        zip_location = os.path.join(os.path.dirname(sublime.executable_path()), "Packages", package + ".sublime-package")
+        file_set.update(_find_zip_resource(zip_location, pattern))
 
-        if VERSION >= 3006:
-            zip_location = os.path.join(sublime.installed_packages_path(), package + ".sublime-package")
-            file_set.update(_find_zip_resource(zip_location, resource_pattern))
-            zip_location = os.path.join(os.path.dirname(sublime.executable_path()), "Packages", package + ".sublime-package")
-            file_set.update(_find_zip_resource(zip_location, resource_pattern))
-        ret_list = map(lambda e: package + "/" + e, file_set)
+    return [package + "/" + entry for entry in file_set]
+
+@instrumented
+def iter_search_resources(pattern, packages=None, ignore_patterns=[], max_workers=SEARCH_WORKERS, max_size=SEARCH_MAX_SIZE):
+    """
+    Search the content of package resources, reading archive members
+    directly from the archives. Yields (package, resource, line number,
+    line) for every matching line, package by package as each one is
+    searched. Binary and undecodable resources are skipped.
+
+    Arguments:
+    pattern             Regular expression (or compiled pattern) to search for.
+                        Strings are compiled with re.MULTILINE.
+    packages            Packages to search. All packages are searched if None.
+    ignore_patterns     Patterns of file and directory names to skip.
+    max_workers         Number of threads used to search the packages.
+    max_size            Resources larger than this are skipped.
+    """
+    if not hasattr(pattern, "search"):
+        pattern = re.compile(pattern, re.MULTILINE)
+    if packages is None:
+        packages = get_packages_list()
+    matcher = _get_ignore_matcher(ignore_patterns)
+
+    for matches in _iter_package_results(packages, max_workers, _search_package, pattern, matcher, max_size):
+        for match in matches:
+            yield match
+
+def _search_package(package, pattern, matcher, max_size):
+    matches = []
+    for resource, size, open_stream in _iter_package_sources(package, matcher):
+        if size is not None and size > max_size:
+            continue
 
-    return sorted(ret_list)
+        try:
+            with open_stream() as stream:
+                text = _read_text(stream, max_size)
+        except (IOError, OSError):
+            continue
+        if text is None or pattern.search(text) is None:
+            continue
 
+        for line_number, line in enumerate(text.split("\n"), 1):
+            if pattern.search(line):
+                matches.append((package, resource, line_number, line))
+    return matches
 
+def _read_text(stream, max_size):
+    data = stream.read(max_size + 1)
+    if len(data) > max_size or b"\0" in data[:8192]:
+        return None
+    try:
+        return _normalize_newlines(data.decode("utf-8"))
+    except UnicodeDecodeError:
+        return None
+
+def _iter_package_sources(package, matcher=None):
+    """
+    Yield (resource, size, open function) for the resources of a package as
+    Sublime Text resolves them: loose files shadow archive members, and the
+    Installed Packages archive shadows the one next to the executable. The
+    size is None for loose files. Each archive stays pinned in the pool
+    while its members are yielded.
+    """
+    seen = set()
+    package_path = os.path.join(sublime.packages_path(), package, "")
+    for resource in _get_index().list_folder(package_path, matcher):
+        seen.add(resource)
+        path = os.path.join(package_path, *resource.split("/"))
+        yield resource, None, functools.partial(open, path, "rb")
+
+    for path_to_zip in _get_package_archive_paths(package):
+        with _pinned_archive(path_to_zip) as archive:
+            if archive is None:
+                continue
+            for name, info in archive.members.items():
+                if name.endswith("/") or name in seen or (matcher is not None and matcher.ignore_path(name)):
+                    continue
+                seen.add(name)
+                yield name, info.file_size, functools.partial(_open_zip_member, archive, name)
+
+
+@instrumented
 def list_package_files(package, ignore_patterns=[]):
     """
     List files in the specified package.
     """
+    matcher = _get_ignore_matcher(ignore_patterns)
+    return sorted(_normalize_member_name(filename) for filename in _get_package_file_set(package, matcher))
+
+def _get_package_file_set(package, matcher):
+    """
+    Return the names of a package's loose files and archive members that
+    are not ignored by the matcher. Archive directory entries keep their
+    trailing "/".
+    """
     package_path = os.path.join(sublime.packages_path(), package, "")
-    path = None
     file_set = set()
-    file_list = []
-    if os.path.exists(package_path):
-        for root, directories, filenames in os.walk(package_path):
-            temp = root.replace(package_path, "")
-            for filename in filenames:
-                file_list.append(os.path.join(temp, filename))
-
-    file_set.update(file_list)
+    file_set.update(_get_index().list_folder(package_path, matcher))
 
     if VERSION >= 3006:
         sublime_package = package + ".sublime-package"
         packages_path = sublime.installed_packages_path()
-
-        if os.path.exists(os.path.join(packages_path, sublime_package)):
-            file_set.update(_list_files_in_zip(packages_path, sublime_package))
+        file_set.update(_list_files_in_zip(packages_path, sublime_package))
 
         packages_path = os.path.dirname(sublime.executable_path()) + os.sep + "Packages"
+        file_set.update(_list_files_in_zip(packages_path, sublime_package))
+
+    return set(filename for filename in file_set if not matcher.ignore_path(filename))
+
+def _normalize_member_name(name):
+    """
+    Normalize an archive member name, only falling back to the full
+    _normalize_to_sublime_path for names that are not already clean.
+    """
+    if name.endswith("/"):
+        name = name[:-1]
+    if "\\" in name or "./" in name or "//" in name:
+        return _normalize_to_sublime_path(name)
+    return name
 
-        if os.path.exists(os.path.join(packages_path, sublime_package)):
-           file_set.update(_list_files_in_zip(packages_path, sublime_package))
+def _scan_tree(path, matcher=None):
+    """
+    Walk a folder with os.scandir, yielding the "/" separated relative path
+    and the directory entry of every directory and file below it. Entries
+    cache their stat result. Directories ignored by the matcher, and
+    symlinked directories (like os.walk), are not entered.
+    """
+    pending = [("", path)]
+    while len(pending) > 0:
+        prefix, directory = pending.pop()
+        try:
+            dir_entries = _list_dir_entries(directory)
+        except OSError:
+            continue
+
+        for dir_entry in dir_entries:
+            if matcher is not None and matcher.ignore_name(dir_entry.name):
+                continue
+            relative_path = prefix + dir_entry.name
+            if dir_entry.is_dir() and not dir_entry.is_symlink():
+                pending.append((relative_path + "/", dir_entry.path))
+            yield relative_path, dir_entry
+
+if hasattr(os, "scandir"):
+    def _list_dir_entries(directory):
+        return list(os.scandir(directory))
+else:
+    def _list_dir_entries(directory):
+        return [_DirEntry(directory, name) for name in os.listdir(directory)]
+
+    class _DirEntry(object):
+        """
+        Stand-in for os.DirEntry on Python versions without os.scandir.
+        """
+        def __init__(self, directory, name):
+            self.name = name
+            self.path = os.path.join(directory, name)
+            self._stat = None
+
+        def is_dir(self):
+            return os.path.isdir(self.path)
+
+        def is_symlink(self):
+            return os.path.islink(self.path)
+
+        def stat(self):
+            if self._stat is None:
+                self._stat = os.stat(self.path)
+            return self._stat
+
+class ResourceTree(object):
+    """
+    Directory tree of a package listing, as returned by list_package_files.
+    The tree is built once per listing; each directory keeps its sorted
+    subdirectory and file names, and is only split out of the listing when
+    it is first visited.
+    """
+    def __init__(self, files):
+        self.root = ResourceTreeNode(files)
+
+    def find(self, path):
+        """
+        Return the node of a "/" separated directory path, or None.
+        """
+        node = self.root
+        for name in path.split("/"):
+            if len(name) > 0:
+                node = node.child(name)
+                if node is None:
+                    return None
+        return node
+
+class ResourceTreeNode(object):
+    def __init__(self, entries):
+        self._entries = entries
+        self._children = None
+        self._dirs = None
+        self._files = None
+
+    @property
+    def dirs(self):
+        self._expand()
+        return self._dirs
+
+    @property
+    def files(self):
+        self._expand()
+        return self._files
+
+    def is_dir(self, name):
+        self._expand()
+        return name in self._children
+
+    def child(self, name):
+        self._expand()
+        return self._children.get(name)
+
+    def _expand(self):
+        if self._children is not None:
+            return
+
+        grouped = {}
+        files = []
+        for entry in self._entries:
+            head, separator, tail = entry.partition("/")
+            if separator:
+                if head not in grouped:
+                    grouped[head] = []
+                if len(tail) > 0:
+                    grouped[head].append(tail)
+            else:
+                files.append(entry)
 
-    file_list = []
+        self._children = {}
+        for name, entries in grouped.items():
+            self._children[name] = ResourceTreeNode(entries)
+        self._dirs = sorted(grouped)
+        self._files = sorted(name for name in files if name not in grouped)
+        self._entries = None
 
-    for filename in file_set:
-        if not _ignore_file(filename, ignore_patterns):
-            file_list.append(_normalize_to_sublime_path(filename))
+class ResourcePathTable(object):
+    """
+    Flat, sorted table of "Package/path" resource paths, with the lowercase
+    path and lowercase file name of each entry precomputed for searching.
+    The lowercase paths are also joined into a single string, so a search
+    scans the whole table with one regular expression.
+    """
+    def __init__(self, paths):
+        self.paths = sorted(paths)
+        self.lower_paths = [path.lower() for path in self.paths]
+        self.lower_names = [path[path.rfind("/") + 1:] for path in self.lower_paths]
+        self.lower_text = "\n".join(self.lower_paths)
+        self.offsets = []
+        offset = 0
+        for lower_path in self.lower_paths:
+            self.offsets.append(offset)
+            offset += len(lower_path) + 1
+
+    def __len__(self):
+        return len(self.paths)
+
+    def search(self, query, limit=None):
+        """
+        Return the paths matching query, best matches first: file names
+        starting with the query, file names containing it, paths containing
+        it, then paths containing its characters in order (shortest span
+        first). Matching is case insensitive.
+
+        Arguments:
+        query       Text to search for.
+        limit       Maximum number of paths to return, or None for all.
+        """
+        query = query.lower()
+        if len(query) == 0:
+            return self.paths[:limit]
+
+        fuzzy_pattern = _compile_fuzzy_pattern(query)
+        ranked = []
+        position = 0
+        while True:
+            match = fuzzy_pattern.search(self.lower_text, position)
+            if match is None:
+                break
+            index = bisect.bisect_right(self.offsets, match.start()) - 1
+            lower_name = self.lower_names[index]
+            name_position = lower_name.find(query)
+            if name_position == 0:
+                rank = (0, len(lower_name))
+            elif name_position > 0:
+                rank = (1, len(lower_name))
+            elif query in self.lower_paths[index]:
+                rank = (2, len(self.lower_paths[index]))
+            else:
+                rank = (3, match.end() - match.start())
+            ranked.append((rank, index))
+            if index + 1 == len(self.offsets):
+                break
+            position = self.offsets[index + 1]
 
-    return sorted(file_list)
+        ranked.sort()
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [self.paths[index] for rank, index in ranked]
 
-def _ignore_file(filename, ignore_patterns=[]):
-    ignore = False
-    directory, base = os.path.split(filename)
-    for pattern in ignore_patterns:
-        if re.match(pattern, base):
-            return True
+def _compile_fuzzy_pattern(query):
+    """
+    Compile an expression matching the characters of query in order. Each
+    gap is a negated class instead of ".*?", so matching never backtracks,
+    and excludes newlines so a match never spans two paths of the table.
+    """
+    characters = [re.escape(character) for character in query if character != "\n"]
+    parts = characters[:1]
+    for character in characters[1:]:
+        parts.append("[^%s\n]*%s" % (character, character))
+    return re.compile("".join(parts))
+
+@instrumented
+def get_resource_path_table(ignore_patterns=[]):
+    """
+    Return a ResourcePathTable of every resource of every package that is
+    not in the ignored_packages setting. The table is kept between calls;
+    when a table is already available it is returned immediately and
+    rebuilt on a background thread, replacing it for the next call if the
+    package folders or archives changed.
 
-    if len(directory) > 0:
-        ignore = _ignore_file(directory, ignore_patterns)
+    Arguments:
+    ignore_patterns     Patterns of file and directory names to leave out.
+    """
+    key = tuple(ignore_patterns)
+    with _path_tables_lock:
+        entry = _path_tables.get(key)
+        refresh = entry is not None and not entry["refreshing"]
+        if refresh:
+            entry["refreshing"] = True
+
+    if entry is None:
+        table = _build_resource_path_table(ignore_patterns)
+        with _path_tables_lock:
+            _path_tables[key] = {"table": table, "refreshing": False}
+        return table
+
+    if refresh:
+        thread = threading.Thread(target=_refresh_resource_path_table, args=(key, ignore_patterns))
+        thread.daemon = True
+        thread.start()
+    return entry["table"]
+
+def _build_resource_path_table(ignore_patterns):
+    paths = []
+    matcher = _get_ignore_matcher(ignore_patterns)
+    for package in get_packages_list(True, ignore_patterns):
+        prefix = package + "/"
+        resources = [_normalize_member_name(name) for name in _get_package_file_set(package, matcher) if not name.endswith("/")]
+        paths.extend(prefix + resource for resource in sorted(resources))
+    return ResourcePathTable(paths)
+
+def _refresh_resource_path_table(key, ignore_patterns):
+    table = None
+    try:
+        table = _build_resource_path_table(ignore_patterns)
+    finally:
+        with _path_tables_lock:
+            entry = _path_tables[key]
+            entry["refreshing"] = False
+            if table is not None and table.paths != entry["table"].paths:
+                entry["table"] = table
+
+def _get_ignore_matcher(ignore_patterns):
+    key = tuple(ignore_patterns)
+    matcher = _ignore_matchers.get(key)
+    if matcher is None:
+        matcher = _IgnoreMatcher(ignore_patterns)
+        _ignore_matchers[key] = matcher
+    return matcher
+
+class _IgnoreMatcher(object):
+    """
+    The ignore_patterns compiled into a single expression, matched against
+    each file or directory name of a "/" separated path. Results for
+    directory prefixes are memoized, so the directories of an archive
+    listing are only checked once.
+    """
+    def __init__(self, ignore_patterns):
+        self.key = "\n".join(ignore_patterns)
+        self.directories = {}
+        if len(ignore_patterns) == 0:
+            self.ignore_name = lambda name: False
+            return
+
+        try:
+            match = re.compile("|".join("(?:%s)" % pattern for pattern in ignore_patterns)).match
+        except re.error:
+            matches = [re.compile(pattern).match for pattern in ignore_patterns]
+            match = lambda name: any(pattern_match(name) for pattern_match in matches)
+        self.ignore_name = lambda name: bool(match(name))
+
+    def ignore_path(self, path):
+        directory, _, base = path.rstrip("/").rpartition("/")
+        if self.ignore_name(base):
+            return True
+        if len(directory) == 0:
+            return False
 
-    return ignore
+        ignored = self.directories.get(directory)
+        if ignored is None:
+            ignored = self.ignore_path(directory)
+            self.directories[directory] = ignored
+        return ignored
 
 
 def _normalize_to_sublime_path(path):
@@ -140,6 +1035,7 @@ def _normalize_to_sublime_path(path):
     path = re.sub(r"\\", "/", path)
     return path
 
+@instrumented
 def get_package_and_resource_name(path):
     """
     This method will return the package name and resource name from a path.
@@ -151,27 +1047,79 @@ def get_package_and_resource_name(path):
     resource = None
     path = _normalize_to_sublime_path(path)
     if os.path.isabs(path):
-        packages_path = _normalize_to_sublime_path(sublime.packages_path())
-        if path.startswith(packages_path):
-            package, resource = _search_for_package_and_resource(path, packages_path)
-
-        if int(sublime.version()) >= 3006:
-            packages_path = _normalize_to_sublime_path(sublime.installed_packages_path())
-            if path.startswith(packages_path):
-                package, resource = _search_for_package_and_resource(path, packages_path)
-
-            packages_path = _normalize_to_sublime_path(os.path.dirname(sublime.executable_path()) + os.sep + "Packages")
-            if path.startswith(packages_path):
-                package, resource = _search_for_package_and_resource(path, packages_path)
+        for root, prefix in _get_package_roots():
+            if path.startswith(prefix):
+                package, resource = _search_for_package_and_resource(path, prefix)
     else:
-        path = re.sub(r"^Packages/", "", path)
-        split = re.split(r"/", path, 1)
+        if path.startswith("Packages/"):
+            path = path[len("Packages/"):]
+        split = path.split("/", 1)
         package = split[0]
         package = package.replace(".sublime-package", "")
         resource = split[1]
 
     return (package, resource)
 
+def _get_package_roots():
+    """
+    Return the package roots in the order Sublime Text resolves them, as
+    (path, normalized path) pairs. The roots do not change while Sublime
+    Text runs, so they are only normalized once.
+    """
+    global _package_roots
+    if _package_roots is None:
+        paths = [sublime.packages_path()]
+        if VERSION >= 3006:
+            paths.append(sublime.installed_packages_path())
+            paths.append(os.path.join(os.path.dirname(sublime.executable_path()), "Packages"))
+        _package_roots = [(path, _normalize_to_sublime_path(path)) for path in paths]
+    return _package_roots
+
+@instrumented
+def resolve_resource(package, resource):
+    """
+    Return the locations that supply a resource, in the order Sublime Text
+    resolves them: the file in the Packages directory, then the package
+    archive in Installed Packages, then the archive shipped with Sublime
+    Text. The first location wins and the others are shadowed by it.
+    Returns an empty list if no root has the resource.
+
+    Arguments:
+    package     Name of the package.
+    resource    "/" separated path of the resource in the package.
+    """
+    return _resolution_map.resolve(package, resource.replace("\\", "/"))
+
+@instrumented
+def resolve_resources(paths):
+    """
+    Resolve many resource paths in one pass, validating the listing of each
+    package only once. Returns a list of (package, resource, locations) in
+    the order of paths, with locations as returned by resolve_resource.
+    Paths outside of the package roots, or without a resource part, give
+    (None, None, []).
+
+    Arguments:
+    paths       Absolute paths, or paths relative to the Packages directory
+                like "Packages/Default/Main.sublime-menu".
+    """
+    archive_names = {}
+    results = []
+    for path in paths:
+        try:
+            package, resource = get_package_and_resource_name(path)
+        except (ValueError, IndexError):
+            package, resource = None, None
+        if package is None:
+            results.append((None, None, []))
+            continue
+        if package not in archive_names:
+            archive_names[package] = _resolution_map.get_archive_names(package)
+        layers = _resolution_map.get_resource_layers(package, resource, archive_names[package])
+        results.append((package, resource, _resolution_map.get_locations(package, resource, layers)))
+    return results
+
+@instrumented
 def get_packages_list(ignore_packages=True, ignore_patterns=[]):
     """
     Return a list of packages.
@@ -190,24 +1138,29 @@ def get_packages_list(ignore_packages=True, ignore_patterns=[]):
         ignore_set = set(sublime.load_settings(
             "PackageResourceViewer.sublime-settings").get("ignored_packages", []))
 
+    matcher = _get_ignore_matcher(ignore_patterns)
     for package in list(package_set):
-        for pattern in ignore_patterns:
-            if re.match(pattern, package):
-                package_set.discard(package)
-                break
-        if package in ignore_set:
+        if matcher.ignore_name(package) or package in ignore_set:
             package_set.discard(package)
 
     return sorted(list(package_set))
 
-def get_sublime_packages(ignore_packages=True, ignore_patterns=[]):
+@instrumented
+def get_sublime_packages(ignore_packages=True, ignore_patterns=[], include_extracted=False):
+    """
+    Return the packages that only exist as archives. If include_extracted is
+    True, packages previously extracted by this plugin are included as well.
+    """
     package_list = get_packages_list(ignore_packages, ignore_patterns)
-    extracted_list = _get_packages_from_directory(sublime.packages_path())
+    packages_path = sublime.packages_path()
+    extracted_list = _get_packages_from_directory(packages_path)
+    if include_extracted:
+        extracted_list = [x for x in extracted_list if not os.path.exists(os.path.join(packages_path, x, EXTRACTED_MARKER))]
     return [x for x in package_list if x not in extracted_list]
 
 def _get_packages_from_directory(directory, file_ext=""):
     package_list = []
-    for package in os.listdir(directory):
+    for package in _get_index().list_directory(directory):
         if not package.endswith(file_ext):
             continue
         else:
@@ -227,27 +1180,101 @@ def _search_for_package_and_resource(path, packages_path):
     return (package, resource)
 
 
-def _list_files_in_zip(package_path, package):
-    if not os.path.exists(os.path.join(package_path, package)):
-        return []
+class _ResolutionMap(object):
+    """
+    For each package, the member names of its archives in the later roots,
+    kept with the size and mtime of each archive. The layers of a resource
+    are its loose file, checked with a single stat, then the archives that
+    list it, so a lookup costs one stat per root and a set lookup. Layers
+    are tuples of indexes into _get_package_roots.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.packages = {}
+
+    def resolve(self, package, resource):
+        return self.get_locations(package, resource, self.get_resource_layers(package, resource))
+
+    def get_resource_layers(self, package, resource, archive_names=None):
+        """
+        Return the layers of a resource, or None if no root has it.
+        """
+        if archive_names is None:
+            archive_names = self.get_archive_names(package)
+        roots = _get_package_roots()
+        layers = ()
+        if os.path.isfile(os.path.join(roots[0][0], package, *resource.split("/"))):
+            layers = (0,)
+        for root_index, names in enumerate(archive_names, 1):
+            if resource in names:
+                layers += (root_index,)
+        return layers or None
+
+    def get_layers(self, package):
+        """
+        Return a dict mapping every resource of a package to its layers.
+        """
+        layers = {}
+        roots = _get_package_roots()
+        listings = [_get_index().list_folder(os.path.join(roots[0][0], package, ""))]
+        listings.extend(self.get_archive_names(package))
+        for root_index, names in enumerate(listings):
+            for name in names:
+                layers[name] = layers.get(name, ()) + (root_index,)
+        return layers
+
+    def get_archive_names(self, package):
+        """
+        Return a set of member names for each archive root, reread when the
+        size or mtime of an archive changes.
+        """
+        paths = [os.path.join(root, package + ".sublime-package") for root, prefix in _get_package_roots()[1:]]
+        signatures = [_get_stat_signature(_get_stat(path)) for path in paths]
+        with self.lock:
+            entry = self.packages.get(package)
+        if entry is not None and entry[0] == signatures:
+            return entry[1]
+
+        start = _start_timer()
+        index = _get_index()
+        archive_names = [frozenset(name for name in index.list_archive(path) if not name.endswith("/")) for path in paths]
+        _stop_timer("build_resolution_layers", start)
+
+        with self.lock:
+            self.packages[package] = (signatures, archive_names)
+        return archive_names
+
+    def get_locations(self, package, resource, layers):
+        if layers is None:
+            return []
+
+        roots = _get_package_roots()
+        locations = []
+        for root_index in layers:
+            if root_index == 0:
+                locations.append(os.path.join(roots[0][0], package, *resource.split("/")))
+            else:
+                locations.append(os.path.join(roots[root_index][0], package + ".sublime-package"))
+        return locations
 
-    ret_value = []
-    with zipfile.ZipFile(os.path.join(package_path, package)) as zip_file:
-        ret_value = zip_file.namelist()
-    return ret_value
+    def clear(self):
+        with self.lock:
+            self.packages.clear()
 
-def _get_zip_item_content(path_to_zip, resource, return_binary, encoding):
-    if not os.path.exists(path_to_zip):
-        return None
+def _list_files_in_zip(package_path, package):
+    return _get_index().list_archive(os.path.join(package_path, package))
 
-    ret_value = None
+def _get_zip_item_content(path_to_zip, resource, return_binary, encoding):
+    with _pinned_archive(path_to_zip) as archive:
+        if archive is None or resource not in archive.members:
+            return None
+        ret_value = archive.read(resource)
 
-    with zipfile.ZipFile(path_to_zip) as zip_file:
-        namelist = zip_file.namelist()
-        if resource in namelist:
-            ret_value = zip_file.read(resource)
-            if not return_binary:
-                ret_value = ret_value.decode(encoding)
+    _count("bytes_read", len(ret_value))
+    if not return_binary:
+        start = _start_timer()
+        ret_value = ret_value.decode(encoding)
+        _stop_timer("decode", start)
 
     return ret_value
 
@@ -259,44 +1286,55 @@ def _get_directory_item_content(filename, return_binary, encoding):
             encoding = None
         else:
             mode = "r"
+        start = _start_timer()
         with codecs.open(filename, mode, encoding=encoding) as file_obj:
             content = file_obj.read()
+        _stop_timer("read_and_decode" if encoding else "read", start)
+        if _instrumentation.enabled:
+            _count("bytes_read", os.path.getsize(filename))
     return content
 
 def _find_zip_resource(path_to_zip, pattern):
-    ret_list = []
-    if os.path.exists(path_to_zip):
-        with zipfile.ZipFile(path_to_zip) as zip_file:
-            namelist = zip_file.namelist()
-            for name in namelist:
-                if re.search(pattern, name):
-                    ret_list.append(name)
-
-    return ret_list
+    search = re.compile(pattern).search
+    return [name for name in _get_index().list_archive(path_to_zip) if search(name)]
 
 def _find_directory_resource(path, pattern):
-    ret_list = []
-    if os.path.exists(path):
-        path = os.path.join(path, "")
-        for root, directories, filenames in os.walk(path):
-            temp = root.replace(path, "")
-            for filename in filenames:
-                if re.search(pattern, os.path.join(temp, filename)):
-                    ret_list.append(os.path.join(temp, filename))
-    return ret_list
+    search = re.compile(pattern).search
+    return [filename for filename in _get_index().list_folder(os.path.join(path, "")) if search(filename)]
 
+@instrumented
 def extract_zip_resource(path_to_zip, resource, extract_dir=None):
     if extract_dir is None:
         extract_dir = tempfile.mkdtemp()
 
     file_location = None
-    if os.path.exists(path_to_zip):
-        with zipfile.ZipFile(path_to_zip) as zip_file:
-            file_location = zip_file.extract(resource, extract_dir)
+    with _pinned_archive(path_to_zip) as archive:
+        if archive is not None:
+            with archive.lock:
+                file_location = archive.zip_file.extract(archive.members[resource], extract_dir)
 
     return file_location
 
-def extract_package(package):
+@instrumented
+def extract_package(package, incremental=False, deduplicate=False):
+    """
+    Extract a package archive into the Packages directory.
+
+    Returns a dict with the package name, the number of members written and
+    skipped, the bytes written, the number of members linked from the
+    content store and the bytes that were not written because of it, and
+    the time taken, or None if the package has no archive.
+
+    Arguments:
+    package         Name of the package to extract.
+    incremental     Only write members that are missing or differ from the
+                    archive, based on the CRC32 and size in the central
+                    directory and the manifest stored by the last extraction.
+    deduplicate     Write each unique member once into a content store in
+                    the cache directory and hardlink it into the package
+                    folder. Editing a linked file in place changes it in
+                    every package that shares it.
+    """
     if VERSION >= 3006:
         package_location = os.path.join(sublime.installed_packages_path(), package + ".sublime-package")
         if not os.path.exists(package_location):
@@ -304,20 +1342,1299 @@ def extract_package(package):
             if not os.path.exists(package_location):
                 package_location = None
         if package_location:
-            with zipfile.ZipFile(package_location) as zip_file:
-                extract_location = os.path.join(sublime.packages_path(), package)
-                zip_file.extractall(extract_location)
+            start_time = time.time()
+            extract_location = os.path.join(sublime.packages_path(), package)
+            marker_path = os.path.join(extract_location, EXTRACTED_MARKER)
+            manifest = _load_extract_manifest(marker_path) if incremental else {}
+
+            staging_location = os.path.join(_get_cache_dir(), "staging", package)
+            if os.path.exists(staging_location):
+                shutil.rmtree(staging_location)
+            os.makedirs(staging_location)
+
+            # The marker is only present once every member is in place, so an
+            # interrupted run is never mistaken for a finished one.
+            existing = os.path.isdir(extract_location)
+            if existing and os.path.exists(marker_path):
+                os.remove(marker_path)
+
+            store_location = os.path.join(_get_cache_dir(), "store") if deduplicate else None
+            with _pinned_archive(package_location) as archive:
+                with archive.lock:
+                    result = _extract_members(archive.zip_file, extract_location, staging_location, store_location,
+                        manifest, incremental)
+
+            if existing:
+                _merge_staged_members(staging_location, extract_location)
+                _save_extract_manifest(marker_path, manifest)
+                shutil.rmtree(staging_location, ignore_errors=True)
+            else:
+                _save_extract_manifest(os.path.join(staging_location, EXTRACTED_MARKER), manifest)
+                _move_into_place(staging_location, extract_location)
+
+            result["package"] = package
+            result["time"] = time.time() - start_time
+            return result
+
+    return None
+
+def _extract_members(zip_file, extract_location, staging_location, store_location, manifest, incremental):
+    """
+    Write the members that need extracting into the staging directory,
+    comparing against the files already in the extract location. With a
+    store location, members are linked from the content store instead.
+    """
+    written = 0
+    skipped = 0
+    bytes_written = 0
+    linked = 0
+    bytes_saved = 0
+    for info in zip_file.infolist():
+        target = _get_member_target(extract_location, info.filename)
+        if target is None:
+            continue
+        staged = _get_member_target(staging_location, info.filename)
+
+        if info.filename.endswith("/"):
+            if not os.path.isdir(staged):
+                os.makedirs(staged)
+            continue
+
+        if incremental and _member_unchanged(info, target, manifest.get(info.filename)):
+            skipped += 1
+            manifest[info.filename] = [info.CRC, info.file_size, _get_mtime(target)]
+            continue
+
+        if store_location is None:
+            _write_member(zip_file, info, staged)
+            bytes_written += info.file_size
+        else:
+            store_path, stored = _store_member(zip_file, info, store_location)
+            if _link_file(store_path, staged) and not stored:
+                linked += 1
+                bytes_saved += info.file_size
+            else:
+                bytes_written += info.file_size
+        written += 1
+        manifest[info.filename] = [info.CRC, info.file_size, _get_mtime(staged)]
+
+    return {"members": written, "skipped": skipped, "bytes": bytes_written, "linked": linked, "saved": bytes_saved}
+
+def _store_member(zip_file, info, store_location):
+    """
+    Return the path of the content store file holding a member's data, and
+    whether it had to be written. Store files are grouped by CRC32 and
+    size, named after their SHA-1, and only reused while their size and
+    CRC32 still match the member, since a linked file can be edited in
+    place. New files are published with a hardlink, so a store file that
+    another worker has already published is never replaced.
+    """
+    bucket = os.path.join(store_location, "%08x-%d" % (info.CRC, info.file_size))
+    if os.path.isdir(bucket):
+        digest = hashlib.sha1()
+        with zip_file.open(info) as source:
+            for chunk in iter(lambda: source.read(RESOURCE_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        store_path = os.path.join(bucket, digest.hexdigest())
+        if _store_file_matches(store_path, info):
+            return store_path, False
+    else:
+        try:
+            os.makedirs(bucket)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    handle, temp_path = tempfile.mkstemp(".tmp", "", bucket)
+    digest = hashlib.sha1()
+    with os.fdopen(handle, "wb") as destination:
+        with zip_file.open(info) as source:
+            for chunk in iter(lambda: source.read(RESOURCE_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                destination.write(chunk)
+
+    os.chmod(temp_path, (info.external_attr >> 16) & 0o777 or 0o644)
+    timestamp = time.mktime(info.date_time + (0, 0, -1))
+    os.utime(temp_path, (timestamp, timestamp))
+
+    store_path = os.path.join(bucket, digest.hexdigest())
+    try:
+        while True:
+            try:
+                os.link(temp_path, store_path)
+                return store_path, True
+            except (OSError, AttributeError) as e:
+                if getattr(e, "errno", None) != errno.EEXIST:
+                    # No hardlinks here, so package folders get copies of
+                    # store files and replacing one cannot split a link.
+                    _replace_file(temp_path, store_path)
+                    return store_path, True
+            if _store_file_matches(store_path, info):
+                return store_path, False
+            # The store file was edited through a package that links it.
+            try:
+                os.remove(store_path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _store_file_matches(store_path, info):
+    stat = _get_stat(store_path)
+    return stat is not None and stat.st_size == info.file_size and _get_file_crc32(store_path) == info.CRC
+
+def _link_file(source, target):
+    """
+    Hardlink a content store file into a package folder, copying it when
+    the file system does not support links. Returns True if it was linked.
+    """
+    directory = os.path.dirname(target)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    try:
+        os.link(source, target)
+        return True
+    except (OSError, AttributeError):
+        shutil.copy2(source, target)
+        return False
+
+@instrumented
+def get_extract_store_usage():
+    """
+    Return a dict with the number of files and bytes in the content store
+    used by deduplicated extraction, and the bytes of disk space saved by
+    the package folders that share its files.
+    """
+    files = 0
+    size = 0
+    saved = 0
+    for relative_path, dir_entry in _scan_tree(os.path.join(_get_cache_dir(), "store")):
+        if dir_entry.is_dir() or relative_path.endswith(".tmp"):
+            continue
+        stat = dir_entry.stat()
+        files += 1
+        size += stat.st_size
+        # One link belongs to the store, one to the first package using it.
+        saved += max(stat.st_nlink - 2, 0) * stat.st_size
+    return {"files": files, "bytes": size, "saved": saved}
+
+def _merge_staged_members(staging_location, extract_location):
+    """
+    Move every staged file over its counterpart in an existing package
+    folder, one atomic replace per file.
+    """
+    for relative_path, entry in _scan_tree(staging_location):
+        target = os.path.join(extract_location, *relative_path.split("/"))
+        if entry.is_dir():
+            if not os.path.isdir(target):
+                os.makedirs(target)
+        else:
+            _move_into_place(entry.path, target)
+
+def _move_into_place(source, destination):
+    try:
+        _replace_file(source, destination)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # The cache and Packages directories are on different devices.
+        if os.path.isdir(source):
+            shutil.move(source, destination)
+        else:
+            shutil.copy2(source, destination + ".tmp")
+            _replace_file(destination + ".tmp", destination)
+            os.remove(source)
+
+def _get_member_target(extract_location, name):
+    """
+    Return the path a member is extracted to, dropping drive letters and
+    "." or ".." components the same way ZipFile.extract does.
+    """
+    name = name.replace("/", os.sep)
+    if os.altsep:
+        name = name.replace(os.altsep, os.sep)
+    name = os.path.splitdrive(name)[1]
+    parts = [part for part in name.split(os.sep) if part not in ("", os.curdir, os.pardir)]
+    if len(parts) == 0:
+        return None
+    target = os.path.join(extract_location, *parts)
+    if name.endswith(os.sep):
+        target = os.path.join(target, "")
+    return target
+
+def _member_unchanged(info, target, manifest_entry):
+    stat = _get_stat(target)
+    if stat is None or stat.st_size != info.file_size:
+        return False
+
+    if manifest_entry is not None and manifest_entry == [info.CRC, info.file_size, stat.st_mtime]:
+        return True
+
+    return _get_file_crc32(target) == info.CRC
+
+def _write_member(zip_file, info, target):
+    directory = os.path.dirname(target)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with zip_file.open(info) as source:
+        with open(target, "wb") as destination:
+            shutil.copyfileobj(source, destination)
+
+    mode = (info.external_attr >> 16) & 0o777
+    if mode:
+        os.chmod(target, mode)
+
+    timestamp = time.mktime(info.date_time + (0, 0, -1))
+    os.utime(target, (timestamp, timestamp))
+
+def _get_file_crc32(path):
+    crc = 0
+    with open(path, "rb") as file_obj:
+        for chunk in iter(lambda: file_obj.read(65536), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+def _load_extract_manifest(marker_path):
+    try:
+        with codecs.open(marker_path, "r", encoding="utf-8") as file_obj:
+            manifest = json.load(file_obj)
+    except (IOError, OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+def _save_extract_manifest(marker_path, manifest):
+    _write_json(marker_path, manifest)
+
+def _write_json(path, content):
+    temp_path = path + ".tmp"
+    with codecs.open(temp_path, "w", encoding="utf-8") as file_obj:
+        json.dump(content, file_obj)
+    _replace_file(temp_path, path)
+
+def _get_extract_journal_path():
+    return os.path.join(_get_cache_dir(), "extract_journal.json")
+
+@instrumented
+def get_interrupted_extraction():
+    """
+    Return the packages left over by a bulk extraction that did not finish,
+    as a dict with the remaining "packages" in their original order and the
+    "incremental" and "deduplicate" flags of that run, or None. The journal
+    of a run still in progress in this process is not reported.
+    """
+    if _extraction_lock.locked():
+        return None
+
+    try:
+        with codecs.open(_get_extract_journal_path(), "r", encoding="utf-8") as file_obj:
+            journal = json.load(file_obj)
+        completed = set(journal["completed"])
+        packages = [package for package in journal["packages"] if package not in completed]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+    if len(packages) == 0:
+        return None
+    return {
+        "packages": packages,
+        "incremental": bool(journal.get("incremental", False)),
+        "deduplicate": bool(journal.get("deduplicate", False))
+    }
 
-                full_path = os.path.join(extract_location, '.extracted-sublime-package')
-                if not os.path.exists(full_path):
-                    open(full_path, 'a').close()
+def discard_interrupted_extraction():
+    """
+    Forget an interrupted bulk extraction and remove its staging directories.
+    Does nothing while a bulk extraction is running in this process.
+    """
+    if not _extraction_lock.acquire(False):
+        return
+    try:
+        try:
+            os.remove(_get_extract_journal_path())
+        except OSError:
+            pass
+        shutil.rmtree(os.path.join(_get_cache_dir(), "staging"), ignore_errors=True)
+    finally:
+        _extraction_lock.release()
+
+@instrumented
+def extract_packages(packages, max_workers=EXTRACT_WORKERS, on_extracted=None, incremental=False, deduplicate=False):
+    """
+    Extract several packages on a thread pool.
+
+    Progress is recorded in a journal in the cache directory, which is
+    removed once every package is extracted. If the run is interrupted,
+    get_interrupted_extraction returns the packages that are left. Runs
+    in this process are serialized, since they share the journal and the
+    staging directories.
+
+    Returns a dict with the per-package results of extract_package (in
+    completion order), the total bytes written, skipped, linked from the
+    content store and saved, the wall time of the run and the number of
+    workers used.
+
+    Arguments:
+    packages        List of package names to extract.
+    max_workers     Number of packages extracted at the same time.
+    on_extracted    Optional callback, called with each package result.
+    incremental     Passed to extract_package.
+    deduplicate     Passed to extract_package.
+    """
+    with _extraction_lock:
+        return _extract_packages(packages, max_workers, on_extracted, incremental, deduplicate)
+
+def _extract_packages(packages, max_workers, on_extracted, incremental, deduplicate):
+    start_time = time.time()
+    results = []
+    journal_path = _get_extract_journal_path()
+    journal = {"packages": list(packages), "completed": [], "incremental": incremental, "deduplicate": deduplicate}
+    journal_lock = threading.Lock()
+    if not os.path.exists(os.path.dirname(journal_path)):
+        os.makedirs(os.path.dirname(journal_path))
+    _write_json(journal_path, journal)
+
+    def extracted(package, result):
+        with journal_lock:
+            journal["completed"].append(package)
+            _write_json(journal_path, journal)
+        if result is not None:
+            results.append(result)
+            if on_extracted is not None:
+                on_extracted(result)
+
+    if ThreadPoolExecutor is None or max_workers < 2:
+        max_workers = 1
+        for package in packages:
+            extracted(package, extract_package(package, incremental, deduplicate))
+    else:
+        executor = ThreadPoolExecutor(max_workers)
+        try:
+            futures = dict((executor.submit(extract_package, package, incremental, deduplicate), package) for package in packages)
+            for future in as_completed(futures):
+                extracted(futures[future], future.result())
+        finally:
+            executor.shutdown(True)
+
+    os.remove(journal_path)
+
+    return {
+        "packages": results,
+        "bytes": sum(result["bytes"] for result in results),
+        "skipped": sum(result["skipped"] for result in results),
+        "linked": sum(result["linked"] for result in results),
+        "saved": sum(result["saved"] for result in results),
+        "time": time.time() - start_time,
+        "workers": max_workers
+    }
+
+
+@instrumented
+def export_packages(packages, output_path, ignore_patterns=[], on_exported=None):
+    """
+    Write the resources of several packages into a single zip or tar file
+    without extracting them. Only the resolved layer of each resource is
+    written, under "Package/resource". Archive members are copied into a
+    zip with their compressed data unchanged; loose files are deflated
+    while streaming. Paths ending in .tar, .tar.gz, .tgz or .tar.bz2 are
+    written as tar files. The output is written to a temporary file and
+    moved into place when complete.
+
+    Returns a dict with the packages exported, the number of members
+    written and copied unchanged, the size of the output and the time taken.
+
+    Arguments:
+    packages        List of package names to export.
+    output_path     Path of the zip or tar file to create.
+    ignore_patterns Patterns of file and directory names to leave out.
+    on_exported     Optional callback, called with each package name.
+    """
+    start_time = time.time()
+    matcher = _get_ignore_matcher(ignore_patterns)
+    result = {"packages": [], "members": 0, "copied": 0}
+    temp_path = output_path + ".tmp"
+    try:
+        with open(temp_path, "wb") as file_obj:
+            if output_path.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2")):
+                writer = _TarStreamWriter(file_obj, output_path)
+            else:
+                writer = _ZipStreamWriter(file_obj)
+            for package in packages:
+                _export_package(writer, package, matcher, result)
+                result["packages"].append(package)
+                if on_exported is not None:
+                    on_exported(package)
+            writer.close()
+        _replace_file(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    result["bytes"] = os.path.getsize(output_path)
+    result["time"] = time.time() - start_time
+    return result
+
+def _export_package(writer, package, matcher, result):
+    roots = _get_package_roots()
+    layers = _resolution_map.get_layers(package)
+    loose_resources = []
+    archive_resources = {}
+    for resource, root_indexes in layers.items():
+        if resource == EXTRACTED_MARKER or matcher.ignore_path(resource):
+            continue
+        if root_indexes[0] == 0:
+            loose_resources.append(resource)
+        else:
+            archive_resources.setdefault(root_indexes[0], []).append(resource)
+
+    for root_index, resources in sorted(archive_resources.items()):
+        path_to_zip = os.path.join(roots[root_index][0], package + ".sublime-package")
+        members = [(resource, package + "/" + resource) for resource in resources]
+        copied = writer.add_archive_members(path_to_zip, members)
+        result["members"] += len(members)
+        result["copied"] += copied
+
+    for resource in sorted(loose_resources):
+        writer.add_file(package + "/" + resource, os.path.join(roots[0][0], package, *resource.split("/")))
+        result["members"] += 1
+
+@instrumented
+def get_override_report(packages=None, ignore_patterns=[], max_workers=SEARCH_WORKERS):
+    """
+    Compare the loose files of packages that also have an archive with the
+    archive members they shadow. Only the CRC32 and size stored in the
+    central directory are used for the archive side, and loose files are
+    only hashed when their size matches.
+
+    Returns a list of (package, resource, status) sorted by package and
+    resource, where status is "identical", "modified" or "orphaned" (no
+    matching archive member).
+    """
+    if packages is None:
+        packages = get_packages_list()
+    matcher = _get_ignore_matcher(ignore_patterns)
+
+    report = []
+    for entries in _iter_package_results(packages, max_workers, _get_package_overrides, matcher):
+        report.extend(entries)
+    return sorted(report)
+
+def _get_package_overrides(package, matcher):
+    central_directories = []
+    for path_to_zip in _get_package_archive_paths(package):
+        if os.path.isfile(path_to_zip):
+            central_directories.append(_CentralDirectory(path_to_zip))
+    if len(central_directories) == 0:
+        return []
+
+    package_path = os.path.join(sublime.packages_path(), package, "")
+    entries = []
+    for resource in _get_index().list_folder(package_path, matcher):
+        if resource == EXTRACTED_MARKER:
+            continue
+
+        status = "orphaned"
+        for central_directory in central_directories:
+            position = central_directory.positions.get(resource)
+            if position is None:
+                continue
+
+            path = os.path.join(package_path, *resource.split("/"))
+            if (os.path.getsize(path) == central_directory.file_sizes[position] and
+                    _get_file_crc32(path) == central_directory.crcs[position]):
+                status = "identical"
+            else:
+                status = "modified"
+            break
+        entries.append((package, resource, status))
+    return entries
+
+def _get_cache_dir():
+    if hasattr(sublime, "cache_path"):
+        cache_path = sublime.cache_path()
+    else:
+        cache_path = os.path.join(os.path.dirname(sublime.packages_path()), "Cache")
+    return os.path.join(cache_path, "PackageResourceViewer")
+
+def _get_stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def _get_mtime(path):
+    stat = _get_stat(path)
+    if stat is None:
+        return None
+    return stat.st_mtime
+
+def _replace_file(source, destination):
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    else:
+        if os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+def _get_index():
+    global _resource_index
+    with _resource_index_lock:
+        if _resource_index is None:
+            _resource_index = _ResourceIndex(os.path.join(_get_cache_dir(), "resource_index.json"))
+            _resource_index.load()
+    return _resource_index
+
+class _ResourceIndex(object):
+    """
+    Persistent listing of the package roots, loose package folders and
+    package archives. Entries are revalidated against the mtime of the
+    source (and the size for archives), so only changed sources are re-read.
+    A listing is not kept while a source's mtime is within INDEX_RACY_WINDOW
+    seconds of the scan, since file systems with coarse timestamps can
+    change it again without changing the mtime.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.directories = {}
+        self.folders = {}
+        self.archives = {}
+        self.save_timer = None
+
+    def load(self):
+        try:
+            with codecs.open(self.path, "r", encoding="utf-8") as file_obj:
+                data = json.load(file_obj)
+        except (IOError, OSError, ValueError):
+            return
+
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return
+
+        with self.lock:
+            self.directories = data.get("directories", {})
+            self.folders = data.get("folders", {})
+            self.archives = data.get("archives", {})
+
+    def save(self):
+        with self.lock:
+            self.save_timer = None
+            content = json.dumps({
+                "version": INDEX_VERSION,
+                "directories": self.directories,
+                "folders": self.folders,
+                "archives": self.archives
+            })
+
+        temp_path = self.path + ".tmp"
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            with codecs.open(temp_path, "w", encoding="utf-8") as file_obj:
+                file_obj.write(content)
+            _replace_file(temp_path, self.path)
+        except (IOError, OSError):
+            pass
+
+    def list_directory(self, directory):
+        """
+        Return the entries of a package root.
+        """
+        mtime = _get_mtime(directory)
+        with self.lock:
+            entry = self.directories.get(directory)
+            if entry is not None and entry["mtime"] == mtime:
+                return entry["names"]
+
+        scan_time = time.time()
+        start = _start_timer()
+        names = os.listdir(directory)
+        _stop_timer("os.listdir", start)
+        self._store(self.directories, directory, {"mtime": mtime, "names": names}, self._is_racy(mtime, scan_time))
+        return names
+
+    def list_folder(self, path, matcher=None):
+        """
+        Return the "/" separated files of a loose package folder. The
+        listing is reused as long as the mtime of every directory in the
+        folder is unchanged. Directories and files ignored by the matcher
+        are pruned while walking.
+        """
+        key = path if matcher is None or len(matcher.key) == 0 else path + "\n" + matcher.key
+        with self.lock:
+            entry = self.folders.get(key)
+
+        if entry is not None and self._folder_unchanged(path, entry["dirs"]):
+            return entry["files"]
+
+        if not os.path.isdir(path):
+            if entry is not None:
+                with self.lock:
+                    self.folders.pop(key, None)
+                    self._changed()
+            return []
+
+        scan_time = time.time()
+        start = _start_timer()
+        dirs = {"": _get_mtime(path)}
+        files = []
+        for relative_path, dir_entry in _scan_tree(path, matcher):
+            if not dir_entry.is_dir():
+                files.append(relative_path)
+            elif not dir_entry.is_symlink():
+                dirs[relative_path] = dir_entry.stat().st_mtime
+        _stop_timer("scan_tree", start)
+
+        racy = any(self._is_racy(mtime, scan_time) for mtime in dirs.values())
+        self._store(self.folders, key, {"dirs": dirs, "files": files}, racy)
+        return files
+
+    def list_archive(self, path):
+        """
+        Return the member names of a package archive.
+        """
+        stat = _get_stat(path)
+        with self.lock:
+            entry = self.archives.get(path)
+            if stat is None:
+                if entry is not None:
+                    self.archives.pop(path)
+                    self._changed()
+                return []
+
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                return entry["names"]
+
+        scan_time = time.time()
+        try:
+            names = _CentralDirectory(path).names
+        except (IOError, OSError):
+            return []
+
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime, "names": names}
+        self._store(self.archives, path, entry, self._is_racy(stat.st_mtime, scan_time))
+        return names
+
+    def _store(self, entries, key, entry, racy):
+        with self.lock:
+            if not racy:
+                entries[key] = entry
+            elif entries.pop(key, None) is None:
+                return
+            self._changed()
+
+    def _is_racy(self, mtime, scan_time):
+        return mtime is None or mtime >= scan_time - INDEX_RACY_WINDOW
+
+    def _folder_unchanged(self, path, dirs):
+        for relative_dir, mtime in dirs.items():
+            if _get_mtime(os.path.join(path, relative_dir)) != mtime:
+                return False
+        return True
+
+    def _changed(self):
+        if self.save_timer is None:
+            self.save_timer = threading.Timer(INDEX_SAVE_DELAY, self.save)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+class _CentralDirectory(object):
+    """
+    Member table of an archive, parsed from the end of central directory
+    record and the central directory in one bulk read, without creating a
+    ZipInfo per member. Names, flags, CRC32s, sizes, compression methods,
+    DOS timestamps, external attributes and local header offsets are kept
+    in parallel arrays; positions maps each name to its index. Zip64
+    archives and the UTF-8 name flag are supported.
+    """
+    def __init__(self, path):
+        start = _start_timer()
+        self.names = []
+        self.flags = array("H")
+        self.crcs = array("L")
+        self.file_sizes = array("Q")
+        self.compress_sizes = array("Q")
+        self.compress_types = array("H")
+        self.dos_times = array("L")
+        self.external_attrs = array("L")
+        self.header_offsets = array("Q")
+
+        with open(path, "rb") as file_obj:
+            entries, directory_size, directory_offset, concat = self._read_end_record(file_obj)
+            file_obj.seek(directory_offset + concat)
+            data = file_obj.read(directory_size)
+
+        self._parse_entries(data, entries, concat)
+        self.positions = dict(zip(self.names, range(len(self.names))))
+        _stop_timer("central_directory_table", start)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _read_end_record(self, file_obj):
+        file_obj.seek(0, os.SEEK_END)
+        file_size = file_obj.tell()
+        tail_size = min(file_size, 22 + 0xFFFF + 20)
+        file_obj.seek(file_size - tail_size)
+        tail = file_obj.read(tail_size)
+
+        position = tail.rfind(b"PK\x05\x06")
+        while position >= 0:
+            if position + 22 <= len(tail):
+                comment_length = struct.unpack("<H", tail[position + 20:position + 22])[0]
+                if position + 22 + comment_length == len(tail):
+                    break
+            position = tail.rfind(b"PK\x05\x06", 0, position)
+        if position < 0:
+            raise zipfile.BadZipfile("End of central directory record not found")
+
+        end_record_position = file_size - tail_size + position
+        entries, directory_size, directory_offset = struct.unpack("<2xHLL", tail[position + 8:position + 20])
+
+        if position >= 20 and tail[position - 20:position - 16] == b"PK\x06\x07":
+            record_position = end_record_position - 20 - 56
+            file_obj.seek(record_position)
+            record = file_obj.read(56)
+            if len(record) != 56 or record[:4] != b"PK\x06\x06":
+                raise zipfile.BadZipfile("Corrupt zip64 end of central directory record")
+            entries, directory_size, directory_offset = struct.unpack("<8xQQQ", record[24:56])
+            end_record_position = record_position
+
+        concat = end_record_position - directory_size - directory_offset
+        return entries, directory_size, directory_offset, concat
+
+    def _parse_entries(self, data, entries, concat):
+        position = 0
+        for _ in range(entries):
+            header = data[position:position + 46]
+            if len(header) != 46 or header[:4] != b"PK\x01\x02":
+                raise zipfile.BadZipfile("Bad central directory entry")
+
+            (flags, compress_type, dos_time, crc, compress_size, file_size, name_length,
+                extra_length, comment_length, external_attr, header_offset) = struct.unpack("<8xHHLLLLHHH4xLL", header)
+            position += 46
+            name = data[position:position + name_length]
+            position += name_length
+            extra = data[position:position + extra_length]
+            position += extra_length + comment_length
+
+            if 0xFFFFFFFF in (file_size, compress_size, header_offset):
+                file_size, compress_size, header_offset = self._read_zip64_extra(
+                    extra, file_size, compress_size, header_offset)
+
+            self.names.append(name.decode("utf-8" if flags & 0x800 else "cp437"))
+            self.flags.append(flags)
+            self.crcs.append(crc)
+            self.file_sizes.append(file_size)
+            self.compress_sizes.append(compress_size)
+            self.compress_types.append(compress_type)
+            self.dos_times.append(dos_time)
+            self.external_attrs.append(external_attr)
+            self.header_offsets.append(header_offset + concat)
+
+    def _read_zip64_extra(self, extra, file_size, compress_size, header_offset):
+        position = 0
+        while position + 4 <= len(extra):
+            field_id, field_length = struct.unpack("<HH", extra[position:position + 4])
+            position += 4
+            if field_id == 0x0001:
+                values = list(struct.unpack("<%dQ" % (field_length // 8), extra[position:position + field_length - field_length % 8]))
+                if file_size == 0xFFFFFFFF:
+                    file_size = values.pop(0)
+                if compress_size == 0xFFFFFFFF:
+                    compress_size = values.pop(0)
+                if header_offset == 0xFFFFFFFF:
+                    header_offset = values.pop(0)
+                break
+            position += field_length
+        return file_size, compress_size, header_offset
+
+class _ZipStreamWriter(object):
+    """
+    Minimal zip writer that can copy the compressed data of another
+    archive's members unchanged, which ZipFile does not support. Loose
+    files are deflated while streaming and their local header is patched
+    once the CRC32 and compressed size are known. Zip64 records are written
+    when sizes, offsets or the number of members need them.
+    """
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.entries = []
+
+    def add_archive_members(self, path_to_zip, members):
+        """
+        Copy members, as (name, archive name) pairs, in the order of their
+        data in the source archive. Returns the number of members copied.
+        """
+        central_directory = _CentralDirectory(path_to_zip)
+        positions = []
+        for name, arcname in members:
+            position = central_directory.positions.get(name)
+            if position is not None:
+                positions.append((central_directory.header_offsets[position], position, arcname))
+        positions.sort()
+
+        with open(path_to_zip, "rb") as source:
+            for header_offset, position, arcname in positions:
+                data_offset = _read_local_header_end(source, header_offset, central_directory.names[position])
+                source.seek(data_offset)
+                self._add_entry(arcname, central_directory.flags[position] & ~0x08,
+                    central_directory.compress_types[position], central_directory.dos_times[position],
+                    central_directory.crcs[position], central_directory.compress_sizes[position],
+                    central_directory.file_sizes[position], central_directory.external_attrs[position],
+                    lambda: _copy_bytes(source, self.file_obj, central_directory.compress_sizes[position]))
+        _count("export_members_copied", len(positions))
+        return len(positions)
+
+    def add_file(self, arcname, path):
+        stat = os.stat(path)
+        zip64 = stat.st_size * 1.05 > zipfile.ZIP64_LIMIT
+        sizes = {"crc": 0, "compress_size": 0, "file_size": 0}
+
+        def write_data():
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            with open(path, "rb") as source:
+                for chunk in iter(lambda: source.read(RESOURCE_CHUNK_SIZE), b""):
+                    sizes["file_size"] += len(chunk)
+                    sizes["crc"] = zlib.crc32(chunk, sizes["crc"])
+                    self._write(compressor.compress(chunk), sizes)
+            self._write(compressor.flush(), sizes)
+            if not zip64 and max(sizes["file_size"], sizes["compress_size"]) > zipfile.ZIP64_LIMIT:
+                raise zipfile.LargeZipFile("%s grew past the zip64 limit while exporting" % path)
+
+        entry = self._add_entry(arcname, 0, zipfile.ZIP_DEFLATED, _get_dos_time(stat.st_mtime), 0,
+            0xFFFFFFFF if zip64 else 0, 0xFFFFFFFF if zip64 else 0, (stat.st_mode & 0xFFFF) << 16, write_data)
+
+        end = self.file_obj.tell()
+        entry["crc"] = sizes["crc"] & 0xFFFFFFFF
+        entry["compress_size"] = sizes["compress_size"]
+        entry["file_size"] = sizes["file_size"]
+        self.file_obj.seek(entry["header_offset"])
+        self._write_local_header(entry)
+        self.file_obj.seek(end)
+
+    def close(self):
+        directory_offset = self.file_obj.tell()
+        for entry in self.entries:
+            extra = []
+            file_size = entry["file_size"]
+            compress_size = entry["compress_size"]
+            header_offset = entry["header_offset"]
+            if file_size > zipfile.ZIP64_LIMIT:
+                extra.append(file_size)
+                file_size = 0xFFFFFFFF
+            if compress_size > zipfile.ZIP64_LIMIT:
+                extra.append(compress_size)
+                compress_size = 0xFFFFFFFF
+            if header_offset > zipfile.ZIP64_LIMIT:
+                extra.append(header_offset)
+                header_offset = 0xFFFFFFFF
+            extra_data = struct.pack("<HH%dQ" % len(extra), 0x0001, 8 * len(extra), *extra) if extra else b""
+            version = 45 if extra else 20
+            self.file_obj.write(struct.pack("<4sHHHHLLLLHHHHHLL", b"PK\x01\x02", (3 << 8) | version, version,
+                entry["flags"], entry["compress_type"], entry["dos_time"], entry["crc"], compress_size, file_size,
+                len(entry["name"]), len(extra_data), 0, 0, 0, entry["external_attr"], header_offset))
+            self.file_obj.write(entry["name"])
+            self.file_obj.write(extra_data)
+
+        directory_end = self.file_obj.tell()
+        entries = len(self.entries)
+        directory_size = directory_end - directory_offset
+        if entries > 0xFFFF or directory_offset > zipfile.ZIP64_LIMIT or directory_size > zipfile.ZIP64_LIMIT:
+            self.file_obj.write(struct.pack("<4sQHHLLQQQQ", b"PK\x06\x06", 44, 45, 45, 0, 0,
+                entries, entries, directory_size, directory_offset))
+            self.file_obj.write(struct.pack("<4sLQL", b"PK\x06\x07", 0, directory_end, 1))
+            entries = min(entries, 0xFFFF)
+            directory_size = min(directory_size, 0xFFFFFFFF)
+            directory_offset = min(directory_offset, 0xFFFFFFFF)
+        self.file_obj.write(struct.pack("<4sHHHHLLH", b"PK\x05\x06", 0, 0, entries, entries,
+            directory_size, directory_offset, 0))
+
+    def _add_entry(self, arcname, flags, compress_type, dos_time, crc, compress_size, file_size, external_attr, write_data):
+        try:
+            name = arcname.encode("ascii")
+            flags &= ~0x800
+        except UnicodeEncodeError:
+            name = arcname.encode("utf-8")
+            flags |= 0x800
+
+        entry = {
+            "name": name,
+            "flags": flags,
+            "compress_type": compress_type,
+            "dos_time": dos_time,
+            "crc": crc,
+            "compress_size": compress_size,
+            "file_size": file_size,
+            "external_attr": external_attr,
+            "header_offset": self.file_obj.tell()
+        }
+        entry["zip64"] = max(file_size, compress_size) > zipfile.ZIP64_LIMIT
+        self._write_local_header(entry)
+        write_data()
+        self.entries.append(entry)
+        return entry
+
+    def _write_local_header(self, entry):
+        if entry["zip64"]:
+            extra_data = struct.pack("<HHQQ", 0x0001, 16, entry["file_size"], entry["compress_size"])
+            compress_size = file_size = 0xFFFFFFFF
+        else:
+            extra_data = b""
+            compress_size = entry["compress_size"]
+            file_size = entry["file_size"]
+        self.file_obj.write(struct.pack("<4sHHHLLLLHH", b"PK\x03\x04", 45 if entry["zip64"] else 20,
+            entry["flags"], entry["compress_type"], entry["dos_time"], entry["crc"], compress_size, file_size,
+            len(entry["name"]), len(extra_data)))
+        self.file_obj.write(entry["name"])
+        self.file_obj.write(extra_data)
+
+    def _write(self, data, sizes):
+        if len(data) > 0:
+            self.file_obj.write(data)
+            sizes["compress_size"] += len(data)
+
+class _TarStreamWriter(object):
+    """
+    Writes exported members into a tar file. Archive members are
+    decompressed while streaming since tar cannot hold deflated data.
+    """
+    def __init__(self, file_obj, output_path):
+        mode = "w"
+        if output_path.endswith((".tar.gz", ".tgz")):
+            mode = "w:gz"
+        elif output_path.endswith(".tar.bz2"):
+            mode = "w:bz2"
+        self.tar_file = tarfile.open(fileobj=file_obj, mode=mode)
+
+    def add_archive_members(self, path_to_zip, members):
+        with _pinned_archive(path_to_zip) as archive:
+            if archive is None:
+                return 0
+
+            members = [(archive.members[name], arcname) for name, arcname in members if name in archive.members]
+            members.sort(key=lambda member: member[0].header_offset)
+            for info, arcname in members:
+                tar_info = tarfile.TarInfo(arcname)
+                tar_info.size = info.file_size
+                tar_info.mtime = time.mktime(info.date_time + (0, 0, -1))
+                tar_info.mode = (info.external_attr >> 16) & 0o777 or 0o644
+                source = _open_zip_member(archive, info.filename)
+                try:
+                    self.tar_file.addfile(tar_info, source)
+                finally:
+                    source.close()
+        return 0
+
+    def add_file(self, arcname, path):
+        tar_info = self.tar_file.gettarinfo(path, arcname)
+        with open(path, "rb") as source:
+            self.tar_file.addfile(tar_info, source)
+
+    def close(self):
+        self.tar_file.close()
+
+def _copy_bytes(source, destination, size):
+    while size > 0:
+        chunk = source.read(min(size, RESOURCE_CHUNK_SIZE))
+        if len(chunk) == 0:
+            raise zipfile.BadZipfile("Truncated archive member")
+        destination.write(chunk)
+        size -= len(chunk)
+
+def _get_dos_time(timestamp):
+    date_time = time.localtime(timestamp)
+    if date_time.tm_year < 1980:
+        return (1 << 21) | (1 << 16)
+    return (((date_time.tm_year - 1980) << 25) | (date_time.tm_mon << 21) | (date_time.tm_mday << 16) |
+        (date_time.tm_hour << 11) | (date_time.tm_min << 5) | (date_time.tm_sec // 2))
+
+class _PooledZip(object):
+    """
+    An open package archive with a name to ZipInfo lookup. The lock must be
+    held while using zip_file directly since the archive is shared between
+    threads. users counts the callers that pinned it through the pool.
+    """
+    def __init__(self, path, stat):
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.lock = threading.RLock()
+        self.last_used = time.time()
+        self.users = 0
+        self.evicted = False
+        start = _start_timer()
+        self.zip_file = zipfile.ZipFile(path)
+        self.members = {}
+        for info in self.zip_file.infolist():
+            self.members[info.filename] = info
+        self.data_offsets = {}
+        _stop_timer("zip.central_directory", start)
+        _count("zip_opens")
+
+    def data_offset(self, info):
+        offset = self.data_offsets.get(info.filename)
+        if offset is None:
+            # Read through a separate handle: zip_file.fp is shared with open
+            # member streams, which seek it under the ZipFile's own lock.
+            with open(self.path, "rb") as file_obj:
+                offset = _get_member_data_offset(file_obj, info)
+            self.data_offsets[info.filename] = offset
+        return offset
+
+    def read(self, name):
+        with self.lock:
+            return self.zip_file.read(self.members[name])
+
+    def close(self):
+        with self.lock:
+            self.zip_file.close()
+
+class _LruDict(object):
+    """
+    Mapping that keeps its keys in least recently used order, since Python
+    2.6 has no OrderedDict. Every touch appends the key to a queue, and
+    queue entries left behind by later touches are skipped when reading it.
+    """
+    def __init__(self):
+        self.data = {}
+        self.stamps = {}
+        self.queue = deque()
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+        self.touch(key)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def touch(self, key):
+        self.counter += 1
+        self.stamps[key] = self.counter
+        self.queue.append((self.counter, key))
+        if len(self.queue) > 2 * len(self.data) + 16:
+            self.queue = deque(self._iter_queue())
+
+    def pop(self, key):
+        del self.stamps[key]
+        return self.data.pop(key)
+
+    def oldest(self):
+        """
+        Return the least recently used key, or None if the mapping is empty.
+        """
+        while len(self.queue) > 0:
+            stamp, key = self.queue[0]
+            if self.stamps.get(key) == stamp:
+                return key
+            self.queue.popleft()
+        return None
+
+    def items(self):
+        """
+        Return a list of (key, value) pairs, least recently used first.
+        """
+        return [(key, self.data[key]) for stamp, key in self._iter_queue()]
+
+    def clear(self):
+        self.data.clear()
+        self.stamps.clear()
+        self.queue.clear()
+
+    def _iter_queue(self):
+        return (item for item in self.queue if self.stamps.get(item[1]) == item[0])
+
+class _ZipPool(object):
+    """
+    Bounded LRU pool of open package archives. An archive is reopened when
+    its size or mtime changes, and idle archives are closed so the files are
+    not held open (and locked on Windows) while packages are upgraded.
+    Archives are pinned between acquire and release; pinned archives are
+    never closed by eviction or the idle sweep, only once released.
+    """
+    def __init__(self, size, idle_timeout):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.archives = _LruDict()
+        self.sweep_timer = None
+
+    def acquire(self, path):
+        """
+        Return the open archive at path, pinned until release is called, or
+        None if there is no archive. The central directory is parsed without
+        holding the pool lock, so archives are opened in parallel.
+        """
+        stat = _get_stat(path)
+        stale = []
+        with self.lock:
+            archive = self.archives.get(path)
+            if archive is not None and (stat is None or archive.size != stat.st_size or archive.mtime != stat.st_mtime):
+                self._retire(path, stale)
+                archive = None
+            if archive is not None:
+                self._pin(path, archive)
+
+        if archive is None and stat is not None:
+            opened = _PooledZip(path, stat)
+            with self.lock:
+                archive = self.archives.get(path)
+                if archive is None or archive.size != opened.size or archive.mtime != opened.mtime:
+                    if archive is not None:
+                        self._retire(path, stale)
+                    archive = opened
+                    self.archives[path] = archive
+                else:
+                    stale.append(opened)
+                self._pin(path, archive)
+                self._evict(stale)
+
+        for stale_archive in stale:
+            stale_archive.close()
+        return archive
+
+    def release(self, archive):
+        with self.lock:
+            archive.users -= 1
+            archive.last_used = time.time()
+            stale = [archive] if archive.evicted and archive.users == 0 else []
+            self._evict(stale)
+
+        for stale_archive in stale:
+            stale_archive.close()
+
+    def close(self):
+        stale = []
+        with self.lock:
+            for path, archive in self.archives.items():
+                self._retire(path, stale)
+        for archive in stale:
+            archive.close()
+
+    def _pin(self, path, archive):
+        archive.users += 1
+        archive.last_used = time.time()
+        self.archives.touch(path)
+        self._schedule_sweep()
+
+    def _retire(self, path, stale):
+        archive = self.archives.pop(path)
+        archive.evicted = True
+        if archive.users == 0:
+            stale.append(archive)
+
+    def _evict(self, stale):
+        excess = len(self.archives) - self.size
+        for path, archive in self.archives.items():
+            if excess <= 0:
+                break
+            if archive.users == 0:
+                self._retire(path, stale)
+                excess -= 1
+
+    def _schedule_sweep(self):
+        if self.sweep_timer is None:
+            self.sweep_timer = threading.Timer(self.idle_timeout, self._sweep)
+            self.sweep_timer.daemon = True
+            self.sweep_timer.start()
+
+    def _sweep(self):
+        idle = []
+        now = time.time()
+        with self.lock:
+            self.sweep_timer = None
+            for path, archive in self.archives.items():
+                if archive.users == 0 and now - archive.last_used >= self.idle_timeout:
+                    self._retire(path, idle)
+            if len(self.archives) > 0:
+                self._schedule_sweep()
+
+        for archive in idle:
+            archive.close()
+
+@contextlib.contextmanager
+def _pinned_archive(path_to_zip):
+    """
+    Acquire an archive from the pool for the duration of a with block. The
+    archive is None if it does not exist.
+    """
+    archive = _zip_pool.acquire(path_to_zip)
+    try:
+        yield archive
+    finally:
+        if archive is not None:
+            _zip_pool.release(archive)
+
+_zip_pool = _ZipPool(ZIP_POOL_SIZE, ZIP_POOL_IDLE_TIMEOUT)
+
+class _ContentCache(object):
+    """
+    LRU cache of loaded resource content, evicted by the total size of the
+    cached content. Entries are only returned while the signature of the
+    resource's sources is unchanged.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = _LruDict()
+        self.total_size = 0
+
+    def get(self, key, signature):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != signature:
+                self._remove(key)
+                return None
+            self.entries.touch(key)
+            return entry[1]
+
+    def put(self, key, signature, content, budget):
+        size = sys.getsizeof(content)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > budget:
+                return
+            self.entries[key] = (signature, content, size)
+            self.total_size += size
+            while self.total_size > budget:
+                self._remove(self.entries.oldest())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_size = 0
+
+    def _remove(self, key):
+        self.total_size -= self.entries.pop(key)[2]
+
+_content_cache = _ContentCache()
+_resolution_map = _ResolutionMap()
 
 
 ####################### Force resource viewer to reload ########################
 import sys
 
 if VERSION > 3000:
-    from imp import reload
+    try:
+        from importlib import reload
+    except ImportError:
+        from imp import reload
     if "PackageResourceViewer.package_resource_viewer" in sys.modules:
         reload(sys.modules["PackageResourceViewer.package_resource_viewer"])
 else: